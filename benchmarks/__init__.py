@@ -0,0 +1 @@
+"""Benchmarks running the script against local stand-ins of external services."""
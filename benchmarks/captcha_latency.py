@@ -0,0 +1,91 @@
+"""
+Benchmark of ReCAPTCHA solving against a local anti-captcha.com stand-in.
+
+Measures end-to-end solve latency, number of polling requests per solve and timeouts, e.g.:
+
+    python -m benchmarks.captcha_latency --solves 20 --concurrency 4 --solve-time 3 --jitter 1 --error-rate 0.1
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from packt.utils.anticaptcha import AnticaptchaException, get_solver
+
+from .mock_anticaptcha import MockAnticaptchaServer
+from .stats import summarize
+
+WEBSITE_URL = 'https://www.packtpub.com/'
+WEBSITE_KEY = 'mock-site-key'
+
+
+def timed_solve(solver):
+    start = time.perf_counter()
+    try:
+        solver.solve_recaptcha(WEBSITE_URL, WEBSITE_KEY)
+        return time.perf_counter() - start, None
+    except AnticaptchaException as e:
+        return time.perf_counter() - start, e
+
+
+@click.command()
+@click.option('--solves', default=10, show_default=True, help='Number of ReCAPTCHAs to solve.')
+@click.option('--concurrency', default=1, show_default=True, help='Number of solves running at the same time.')
+@click.option('--solve-time', default=3.0, show_default=True, help='Mean solve time of the stand-in service [s].')
+@click.option('--jitter', default=0.0, show_default=True, help='Maximum deviation from the mean solve time [s].')
+@click.option('--error-rate', default=0.0, show_default=True, help='Fraction of tasks failing with an error.')
+@click.option('--timeout', default=120.0, show_default=True, help='Solver timeout [s].')
+@click.option('--min-poll-interval', default=None, type=float, help='Override solver minimal poll interval [s].')
+@click.option('--max-poll-interval', default=None, type=float, help='Override solver maximal poll interval [s].')
+@click.option('--backend', default='anticaptcha', show_default=True, help='Captcha solver backend.')
+@click.option('--seed', default=None, type=int, help='Seed of the stand-in service randomness.')
+@click.option('--output', default=None, type=click.Path(), help='Write results as JSON into this file.')
+def main(solves, concurrency, solve_time, jitter, error_rate, timeout, min_poll_interval, max_poll_interval,
+         backend, seed, output):
+    with MockAnticaptchaServer(solve_time, jitter, error_rate, seed=seed) as server:
+        def make_solver():
+            solver = get_solver(backend, 'mock-key', api_url=server.url)
+            solver.timeout = timeout
+            if min_poll_interval is not None:
+                solver.min_poll_interval = min_poll_interval
+            if max_poll_interval is not None:
+                solver.max_poll_interval = max_poll_interval
+            return solver
+
+        solvers = [make_solver() for _ in range(concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(lambda i: timed_solve(solvers[i % concurrency]), range(solves)))
+        wall_time = time.perf_counter() - start
+
+    latencies = [latency for latency, error in results if error is None]
+    errors = [str(error) for _, error in results if error is not None]
+    timeouts = [error for error in errors if 'Timeout' in error]
+    polls = list(server.polls.values())
+    report = {
+        'solves': solves,
+        'succeeded': len(latencies),
+        'timeouts': len(timeouts),
+        'errors': len(errors) - len(timeouts),
+        'wall_time': wall_time,
+        'latency': summarize(latencies),
+        'polls_per_task': summarize(polls),
+        'poll_requests': sum(polls),
+        'requests': sum(server.requests.values()),
+        'settings': {
+            'solve_time': solve_time,
+            'jitter': jitter,
+            'error_rate': error_rate,
+            'timeout': timeout,
+            'concurrency': concurrency
+        }
+    }
+    click.echo(json.dumps(report, indent=2, sort_keys=True))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Local stand-in of anti-captcha.com task API with configurable solve times and error rates."""
+import itertools
+import random
+import threading
+import time
+import uuid
+
+from .mock_server import MockServer
+
+
+class MockAnticaptchaServer(MockServer):
+    """
+    Mimics `createTask`, `getTaskResult` and `getQueueStats` anti-captcha.com endpoints.
+
+    Each task becomes ready after `solve_time` +/- `solve_time_jitter` seconds. A fraction `error_rate` of created
+    tasks fails with an anti-captcha error, either at creation or while being solved.
+    """
+
+    def __init__(self, solve_time=5.0, solve_time_jitter=0.0, error_rate=0.0, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.solve_time = solve_time
+        self.solve_time_jitter = solve_time_jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.tasks = {}
+        self.polls = {}
+        self._task_ids = itertools.count(1)
+        self._tasks_lock = threading.Lock()
+
+    def handle(self, request):
+        endpoint = request.path_only.rstrip('/').rsplit('/', 1)[-1]
+        if request.command != 'POST' or endpoint not in ('createTask', 'getTaskResult', 'getQueueStats'):
+            request.send_json({'errorId': 1, 'errorCode': 'ERROR_NO_SUCH_METHOD'}, status=404)
+            return
+        content = request.read_json()
+        if endpoint == 'createTask':
+            request.send_json(self.create_task(content))
+        elif endpoint == 'getTaskResult':
+            request.send_json(self.get_task_result(content))
+        else:
+            request.send_json({'waiting': 10, 'load': 50.0, 'bid': 0.002, 'speed': self.solve_time, 'total': 100})
+
+    def create_task(self, content):
+        with self._tasks_lock:
+            if self.random.random() < self.error_rate / 2:
+                return {'errorId': 2, 'errorCode': 'ERROR_NO_SLOT_AVAILABLE',
+                        'errorDescription': 'No idle workers are available at the moment.'}
+            task_id = next(self._task_ids)
+            solve_time = max(self.solve_time + self.random.uniform(-1, 1) * self.solve_time_jitter, 0)
+            fails = self.random.random() < self.error_rate / 2
+            self.tasks[task_id] = (time.time() + solve_time, fails)
+            self.polls[task_id] = 0
+        return {'errorId': 0, 'taskId': task_id}
+
+    def get_task_result(self, content):
+        task_id = content.get('taskId')
+        with self._tasks_lock:
+            if task_id not in self.tasks:
+                return {'errorId': 16, 'errorCode': 'ERROR_NO_SUCH_CAPCHA_ID',
+                        'errorDescription': 'Task you are requesting does not exist.'}
+            self.polls[task_id] += 1
+            ready_at, fails = self.tasks[task_id]
+        if time.time() < ready_at:
+            return {'errorId': 0, 'status': 'processing'}
+        if fails:
+            return {'errorId': 12, 'errorCode': 'ERROR_CAPTCHA_UNSOLVABLE',
+                    'errorDescription': 'Workers could not solve the Captcha.'}
+        return {
+            'errorId': 0,
+            'status': 'ready',
+            'solution': {'gRecaptchaResponse': 'mock-{}-{}'.format(task_id, uuid.uuid4().hex)},
+            'cost': '0.00200'
+        }
@@ -0,0 +1,221 @@
+"""Local stand-in of Packt API endpoints used by the script, together with a file server for product downloads."""
+import datetime as dt
+import random
+import re
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+
+from .mock_server import MockServer
+
+PACKT_HOSTS = ('https://services.packtpub.com', 'https://static.packt-cdn.com')
+FILE_CHUNK_SIZE = 16 * 1024
+
+
+class RedirectAdapter(HTTPAdapter):
+    """Transport adapter sending requests to `target_url` host while keeping their path and query."""
+
+    def __init__(self, target_url, **kwargs):
+        super().__init__(**kwargs)
+        self.target = urlsplit(target_url)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = urlunsplit((self.target.scheme, self.target.netloc, parts.path, parts.query, ''))
+        return super().send(request, **kwargs)
+
+
+def redirect_to_mock(session, server):
+    """Make `session` send requests meant for Packt API hosts to the local `server`."""
+    adapter = RedirectAdapter(server.url)
+    for host in PACKT_HOSTS:
+        session.mount(host, adapter)
+    return session
+
+
+class MockPacktAPIServer(MockServer):
+    """
+    Mimics Packt API endpoints from `packt.api` for a library of `library_size` products.
+
+    Product files are served by the same server with `file_size` bytes, `file_latency` seconds before the first byte
+    and throughput limited to `bandwidth` bytes per second (unlimited if None). A fraction `file_error_rate` of file
+    downloads and `api_error_rate` of API requests fails with HTTP 500, every request is delayed by `api_latency`.
+    API requests above `api_max_concurrency` concurrent ones are rejected with HTTP 429 and Retry-After header.
+    """
+    routes = (
+        ('POST', r'/auth-v1/users/tokens', 'login'),
+        ('GET', r'/entitlements-v1/users/me/products', 'products'),
+        ('GET', r'/free-learning-v1/offers', 'offers'),
+        ('GET', r'/users-v1/users/me', 'user'),
+        ('PUT', r'/free-learning-v1/users/(?P<user_id>[^/]+)/claims/(?P<offer_id>[^/]+)', 'claim'),
+        ('GET', r'/products/(?P<product_id>[^/]+)/summary', 'summary'),
+        ('GET', r'/products-v1/products/(?P<product_id>[^/]+)/types', 'file_types'),
+        ('GET', r'/products-v1/products/(?P<product_id>[^/]+)/files/(?P<file_type>[^/]+)', 'file_url'),
+        ('GET', r'/files/(?P<product_id>[^/]+)/(?P<file_type>[^/]+)', 'file'),
+    )
+
+    def __init__(self, library_size=100, file_types=('pdf', 'epub', 'mobi', 'code'), file_size=64 * 1024,
+                 file_latency=0.0, bandwidth=None, file_error_rate=0.0, api_latency=0.0, api_error_rate=0.0,
+                 api_max_concurrency=None, seed=None, **kwargs):
+        super().__init__(**kwargs)
+        self.file_types = list(file_types)
+        self.file_size = file_size
+        self.file_latency = file_latency
+        self.bandwidth = bandwidth
+        self.file_error_rate = file_error_rate
+        self.api_latency = api_latency
+        self.api_error_rate = api_error_rate
+        self.api_max_concurrency = api_max_concurrency
+        self.api_in_flight = 0
+        self.throttled = 0
+        self.random = random.Random(seed)
+        self.tokens = set()
+        self.user_id = str(uuid.uuid4())
+        self.bytes_sent = 0
+        self._state_lock = threading.Lock()
+        self._routes = [(method, re.compile(pattern + '$'), name) for method, pattern, name in self.routes]
+
+        now = dt.datetime.utcnow().replace(microsecond=0)
+        self.products = [
+            {
+                'productId': self.product_id(i),
+                'productName': 'Mock Book {} – Learning Edition'.format(i),
+                'createdAt': (now - dt.timedelta(hours=i + 1)).isoformat() + 'Z'
+            }
+            for i in range(library_size)
+        ]
+        self.offer = {
+            'id': str(uuid.uuid4()),
+            'productId': self.product_id(library_size),
+            'updatedAt': now.isoformat() + 'Z'
+        }
+
+    @staticmethod
+    def product_id(index):
+        return '{:013d}'.format(9781800000000 + index)
+
+    def reset(self):
+        """Forget claimed offer, so that it can be claimed again."""
+        with self._state_lock:
+            self.products = [p for p in self.products if p['productId'] != self.offer['productId']]
+
+    def fails(self, rate):
+        with self._state_lock:
+            return self.random.random() < rate
+
+    def handle(self, request):
+        path = request.path_only
+        for method, pattern, name in self._routes:
+            match = pattern.match(path)
+            if match and method == request.command:
+                break
+        else:
+            request.send_json({'message': 'Not found'}, status=404)
+            return
+
+        if name == 'file':
+            self.serve_file(request, **match.groupdict())
+            return
+        with self._state_lock:
+            throttled = self.api_max_concurrency is not None and self.api_in_flight >= self.api_max_concurrency
+            if throttled:
+                self.throttled += 1
+            else:
+                self.api_in_flight += 1
+        if throttled:
+            request.send_response(429)
+            request.send_header('Retry-After', '1')
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+        try:
+            self.handle_api(request, name, match)
+        finally:
+            with self._state_lock:
+                self.api_in_flight -= 1
+
+    def handle_api(self, request, name, match):
+        if self.api_latency:
+            time.sleep(self.api_latency)
+        if self.fails(self.api_error_rate):
+            request.send_json({'message': 'Injected error'}, status=500)
+            return
+        if name != 'login' and request.headers.get('authorization', '')[len('Bearer '):] not in self.tokens:
+            request.send_json({'message': 'Unauthorized'}, status=401)
+            return
+        status, data = getattr(self, 'handle_' + name)(request, **match.groupdict())
+        request.send_json(data, status=status)
+
+    def handle_login(self, request):
+        credentials = request.read_json()
+        if not credentials.get('username') or not credentials.get('password'):
+            return 400, {'message': 'Invalid credentials'}
+        token = uuid.uuid4().hex
+        with self._state_lock:
+            self.tokens.add(token)
+        return 200, {'data': {'access': token, 'refresh': uuid.uuid4().hex}}
+
+    def handle_products(self, request):
+        offset = int(request.query.get('offset', 0))
+        limit = int(request.query.get('limit', 25))
+        with self._state_lock:
+            products = sorted(self.products, key=lambda p: p['createdAt'], reverse=True)
+        return 200, {'count': len(products), 'data': products[offset:offset + limit]}
+
+    def handle_offers(self, request):
+        return 200, {'count': 1, 'data': [self.offer]}
+
+    def handle_user(self, request):
+        return 200, {'data': [{'id': self.user_id}]}
+
+    def handle_claim(self, request, user_id, offer_id):
+        request.read_json()
+        if user_id != self.user_id or offer_id != self.offer['id']:
+            return 404, {'message': 'Offer not found'}
+        with self._state_lock:
+            if any(p['productId'] == self.offer['productId'] for p in self.products):
+                return 409, {'message': 'Already claimed'}
+            self.products.append({
+                'productId': self.offer['productId'],
+                'productName': 'Mock Free Learning Offer',
+                'createdAt': dt.datetime.utcnow().replace(microsecond=0).isoformat() + 'Z'
+            })
+        return 200, {'data': {'productId': self.offer['productId']}}
+
+    def handle_summary(self, request, product_id):
+        return 200, {'productId': product_id, 'title': 'Mock Book {}'.format(product_id)}
+
+    def handle_file_types(self, request, product_id):
+        return 200, {'data': [{'productId': product_id, 'fileTypes': self.file_types}]}
+
+    def handle_file_url(self, request, product_id, file_type):
+        if file_type not in self.file_types:
+            return 404, {'message': 'File type not available'}
+        return 200, {'data': '{}/files/{}/{}?signature={}'.format(self.url, product_id, file_type, uuid.uuid4().hex)}
+
+    def serve_file(self, request, product_id, file_type):
+        if self.file_latency:
+            time.sleep(self.file_latency)
+        if self.fails(self.file_error_rate):
+            request.send_json({'message': 'Injected error'}, status=500)
+            return
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/octet-stream')
+        request.send_header('Content-Length', str(self.file_size))
+        request.end_headers()
+        chunk = b'\0' * FILE_CHUNK_SIZE
+        remaining = self.file_size
+        try:
+            while remaining > 0:
+                data = chunk[:min(remaining, FILE_CHUNK_SIZE)]
+                request.wfile.write(data)
+                remaining -= len(data)
+                with self._state_lock:
+                    self.bytes_sent += len(data)
+                if self.bandwidth:
+                    time.sleep(len(data) / self.bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
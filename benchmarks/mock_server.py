@@ -0,0 +1,95 @@
+"""Base classes of local HTTP servers standing in for external services in benchmarks."""
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlsplit
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    """Request handler dispatching requests to `MockServer.handle` and providing JSON helpers."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # don't let small JSON responses wait for delayed ACKs
+
+    def log_message(self, format, *args):
+        pass  # keep benchmark output clean
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    @property
+    def path_only(self):
+        return urlsplit(self.path).path
+
+    @property
+    def query(self):
+        return {key: values[-1] for key, values in parse_qs(urlsplit(self.path).query).items()}
+
+    def read_json(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        return json.loads(body.decode('utf-8')) if body else {}
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def handle_method(self):
+        self.mock.count_request(self.command, self.path_only)
+        self.mock.handle(self)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_method
+
+
+class MockServer(object):
+    """
+    Local HTTP server running in a background thread.
+
+    Subclasses implement `handle(request)`, where `request` is a `MockRequestHandler`.
+    Usable as a context manager which starts and stops the server.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MockRequestHandler)
+        self.httpd.mock = self
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def count_request(self, method, path):
+        with self._lock:
+            self.requests[(method, path)] += 1
+
+    def handle(self, request):
+        raise NotImplementedError
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -0,0 +1,170 @@
+"""
+Benchmark suite running library fetch, claim and downloads against a local Packt API stand-in.
+
+For each library size it measures latency of `get_all_books_data`, of the first book streamed by `iter_books_data`
+and of `claim_product`, and latency and throughput of `download_products`, e.g.:
+
+    python -m benchmarks.packt_api --sizes 10,100,1000,10000 --download-books 20 --output results.json
+"""
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+import click
+import requests
+
+from packt.api import PacktAPIClient
+from packt.claimer import claim_product, get_all_books_data, iter_books_data
+from packt.downloader import download_products
+
+from .mock_packt_api import MockPacktAPIServer, redirect_to_mock
+from .stats import summarize
+
+CREDENTIALS = {'username': 'benchmark@example.com', 'password': 'benchmark'}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], universal_newlines=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def requests_made(server, action):
+    """Return result of `action()` together with number of requests it made to the server."""
+    before = sum(server.requests.values())
+    result = action()
+    return result, sum(server.requests.values()) - before
+
+
+def timed(action, repeat):
+    """Return list of `action()` durations in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        action()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def first_book_timings(api_client, repeat):
+    """
+    Return list of durations in seconds until `iter_books_data` yields the first book.
+
+    Closing the generator waits for the library page it's prefetching, so it's closed outside of the measured time.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        books = iter_books_data(api_client)
+        next(books)
+        timings.append(time.perf_counter() - start)
+        books.close()
+    return timings
+
+
+def benchmark_library_size(library_size, repeat, download_books, formats, server_options):
+    with MockPacktAPIServer(library_size=library_size, **server_options) as server:
+        api_client = PacktAPIClient(CREDENTIALS, session=redirect_to_mock(requests.Session(), server))
+        result = {'library_size': library_size}
+
+        books, result['library_fetch_requests'] = requests_made(server, lambda: get_all_books_data(api_client))
+        if len(books or []) != library_size:
+            raise click.ClickException('Fetched {} books instead of {}'.format(len(books or []), library_size))
+        result['library_fetch'] = summarize(timed(lambda: get_all_books_data(api_client), repeat))
+        result['first_book'] = summarize(first_book_timings(api_client, repeat))
+
+        def claim():
+            server.reset()
+            claim_product(api_client, 'mock-recaptcha-solution')
+        result['claim'] = summarize(timed(claim, repeat))
+
+        download_directory = tempfile.mkdtemp(prefix='packt-benchmark-')
+        try:
+            selected = books[:download_books]
+            bytes_before = server.bytes_sent
+            start = time.perf_counter()
+            _, result['download_requests'] = requests_made(
+                server,
+                lambda: download_products(api_client, download_directory, formats, selected)
+            )
+            duration = time.perf_counter() - start
+            downloaded_files = len(os.listdir(download_directory))
+            result['download'] = {
+                'books': len(selected),
+                'files': downloaded_files,
+                'seconds': duration,
+                'seconds_per_file': duration / downloaded_files if downloaded_files else None,
+                'bytes': server.bytes_sent - bytes_before,
+                'megabytes_per_second': (server.bytes_sent - bytes_before) / duration / 1024 ** 2
+            }
+        finally:
+            shutil.rmtree(download_directory)
+        result['rate_limits'] = api_client.rate_limiter.state()
+        result['throttled_requests'] = server.throttled
+    return result
+
+
+@click.command()
+@click.option('--sizes', default='10,100,1000,10000', show_default=True, help='Comma separated library sizes.')
+@click.option('--repeat', default=3, show_default=True, help='Number of measured library fetches and claims.')
+@click.option('--download-books', default=20, show_default=True, help='Number of books downloaded per library size.')
+@click.option('--formats', default='pdf', show_default=True, help='Comma separated downloaded formats.')
+@click.option('--file-size', default=256 * 1024, show_default=True, help='Size of served files [B].')
+@click.option('--file-latency', default=0.0, show_default=True, help='Delay before serving a file [s].')
+@click.option('--bandwidth', default=None, type=int, help='File server bandwidth [B/s], unlimited by default.')
+@click.option('--file-error-rate', default=0.0, show_default=True, help='Fraction of failing file downloads.')
+@click.option('--api-latency', default=0.0, show_default=True, help='Delay of each API response [s].')
+@click.option('--api-error-rate', default=0.0, show_default=True, help='Fraction of failing API requests.')
+@click.option('--api-max-concurrency', default=None, type=int, help='Concurrent API requests allowed before 429.')
+@click.option('--seed', default=None, type=int, help='Seed of injected errors.')
+@click.option('--output', default=None, type=click.Path(), help='Write results as JSON into this file.')
+def main(sizes, repeat, download_books, formats, file_size, file_latency, bandwidth, file_error_rate, api_latency,
+         api_error_rate, api_max_concurrency, seed, output):
+    server_options = {
+        'file_size': file_size,
+        'file_latency': file_latency,
+        'bandwidth': bandwidth,
+        'file_error_rate': file_error_rate,
+        'api_latency': api_latency,
+        'api_error_rate': api_error_rate,
+        'api_max_concurrency': api_max_concurrency,
+        'seed': seed
+    }
+    formats = tuple(f.strip() for f in formats.split(','))
+    results = []
+    for library_size in (int(size) for size in sizes.split(',')):
+        result = benchmark_library_size(library_size, repeat, download_books, formats, server_options)
+        results.append(result)
+        click.echo(
+            '{:>6} books | library fetch {:8.3f} s ({} requests), first book {:6.3f} s | claim {:8.3f} s | '
+            'download {} files {:7.3f} s, {:7.2f} MB/s'.format(
+                library_size,
+                result['library_fetch']['p50'],
+                result['library_fetch_requests'],
+                result['first_book']['p50'],
+                result['claim']['p50'],
+                result['download']['files'],
+                result['download']['seconds'],
+                result['download']['megabytes_per_second']
+            )
+        )
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'timestamp': time.time(),
+                'python': platform.python_version(),
+                'settings': dict(server_options, repeat=repeat, download_books=download_books, formats=formats),
+                'results': results
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
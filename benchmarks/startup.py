@@ -0,0 +1,88 @@
+"""
+Benchmark of `packt-cli` startup time.
+
+Reports wall-clock time of `packt-cli --help` and a `python -X importtime` breakdown of modules imported on the way.
+Fails (exit code 1) when a heavy dependency gets imported at startup or when startup gets slower than allowed, e.g.:
+
+    python -m benchmarks.startup --runs 10 --max-ms 300
+"""
+import json
+import subprocess
+import sys
+import time
+
+import click
+
+from .stats import summarize
+
+CLI_COMMAND = [sys.executable, '-c', 'from packt.packtPublishingFreeEbook import packt_cli; packt_cli()', '--help']
+HEAVY_MODULES = ('requests', 'slugify', 'apiclient', 'googleapiclient', 'oauth2client', 'httplib2')
+
+
+def parse_importtime(stderr):
+    """Return list of (module, self [us], cumulative [us]) tuples parsed from `python -X importtime` output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        imports.append((module.strip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def measure_wall_clock(runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(CLI_COMMAND, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def measure_imports():
+    command = [sys.executable, '-X', 'importtime'] + CLI_COMMAND[1:]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+                            universal_newlines=True)
+    return parse_importtime(result.stderr)
+
+
+@click.command()
+@click.option('--runs', default=5, show_default=True, help='Number of measured `packt-cli --help` runs.')
+@click.option('--top', default=15, show_default=True, help='Number of slowest imports listed.')
+@click.option('--max-ms', default=None, type=float, help='Fail when median startup time exceeds this value [ms].')
+@click.option('--forbid', multiple=True, default=HEAVY_MODULES, show_default=True,
+              help='Fail when one of these top-level modules is imported at startup.')
+@click.option('--output', default=None, type=click.Path(), help='Write results as JSON into this file.')
+def main(runs, top, max_ms, forbid, output):
+    measure_wall_clock(1)  # warm up filesystem and bytecode caches
+    wall_clock = summarize(measure_wall_clock(runs))
+    imports = measure_imports()
+    imported_top_level = {module.split('.')[0] for module, _, _ in imports}
+    forbidden = sorted(imported_top_level.intersection(forbid))
+
+    click.echo('packt-cli --help wall-clock [ms]: median {p50:.1f}, min {min:.1f}, max {max:.1f}'.format(**wall_clock))
+    click.echo('Total import time [ms]: {:.1f}'.format(sum(self_us for _, self_us, _ in imports) / 1000))
+    click.echo('Slowest imports (self / cumulative [ms]):')
+    for module, self_us, cumulative_us in sorted(imports, key=lambda i: i[1], reverse=True)[:top]:
+        click.echo('  {:>8.1f} {:>8.1f}  {}'.format(self_us / 1000, cumulative_us / 1000, module))
+
+    failures = []
+    if forbidden:
+        failures.append('Heavy modules imported at startup: {}'.format(', '.join(forbidden)))
+    if max_ms is not None and wall_clock['p50'] > max_ms:
+        failures.append('Median startup time {:.1f} ms exceeds {:.1f} ms'.format(wall_clock['p50'], max_ms))
+    for failure in failures:
+        click.echo(failure, err=True)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({
+                'wall_clock_ms': wall_clock,
+                'imports': [{'module': m, 'self_us': s, 'cumulative_us': c} for m, s, c in imports],
+                'failures': failures
+            }, f, indent=2, sort_keys=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
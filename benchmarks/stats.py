@@ -0,0 +1,22 @@
+"""Helpers summarizing benchmark measurements."""
+
+
+def percentile(values, fraction):
+    """Return `fraction` percentile of values using nearest-rank method."""
+    ordered = sorted(values)
+    index = max(int(round(fraction * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def summarize(values):
+    """Return count, mean, median, 95th percentile and extremes of given values."""
+    if not values:
+        return {'count': 0}
+    return {
+        'count': len(values),
+        'mean': sum(values) / len(values),
+        'min': min(values),
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'max': max(values)
+    }
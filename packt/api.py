@@ -1,13 +1,19 @@
 """Module with Packt API client handling API's authentication."""
 import logging
+import random
+import time
 
 import requests
 
 from .utils.logger import get_logger
+from .utils.rate_limiter import RateLimiter
+from .utils.timing import count, span
 
 logger = get_logger(__name__)
 logging.getLogger("requests").setLevel(logging.WARNING)  # downgrading logging level for requests
 
+PACKT_URL = 'https://www.packtpub.com/'
+PACKT_RECAPTCHA_SITE_KEY = '6LeAHSgUAAAAAKsn5jo6RUSTLVxGNYyuvUcLMe0_'
 PACKT_API_LOGIN_URL = 'https://services.packtpub.com/auth-v1/users/tokens'
 PACKT_API_PRODUCTS_URL = 'https://services.packtpub.com/entitlements-v1/users/me/products'
 PACKT_PRODUCT_SUMMARY_URL = 'https://static.packt-cdn.com/products/{product_id}/summary'
@@ -18,33 +24,109 @@ PACKT_API_FREE_LEARNING_OFFERS_URL = 'https://services.packtpub.com/free-learnin
 PACKT_API_USER_URL = 'https://services.packtpub.com/users-v1/users/me'
 PACKT_API_FREE_LEARNING_CLAIM_URL = 'https://services.packtpub.com/free-learning-v1/users/{user_id}/claims/{offer_id}'
 DEFAULT_PAGINATION_SIZE = 25
+MAX_RETRIES = 4
+RETRY_BACKOFF = 1.0  # seconds, doubled with each retry
+MAX_RETRY_AFTER = 120
+
+
+class PacktAuthenticationError(Exception):
+    """Error raised when Packt API refuses to issue a JWT for user's credentials."""
+    pass
 
 
 class PacktAPIClient:
-    """Packt API client making API requests on script's behalf."""
+    """
+    Packt API client making API requests on script's behalf.
+
+    `recaptcha` is a ReCAPTCHA solution, or a callable returning a fresh one, sent with the credentials whenever
+    a JWT is fetched, as Packt's login requires it. With `jwt` of an already logged in client (e.g. of a parent
+    process) the client doesn't log in until the JWT expires.
+    """
 
-    def __init__(self, credentials):
-        self.session = requests.Session()
+    def __init__(self, credentials, session=None, rate_limiter=None, recaptcha=None, jwt=None):
+        self.session = session or requests.Session()
         self.credentials = credentials
-        self.fetch_jwt()
+        self.recaptcha = recaptcha
+        self.rate_limiter = rate_limiter or RateLimiter()
+        if jwt is not None:
+            self.session.headers.update({'authorization': 'Bearer {}'.format(jwt)})
+        else:
+            self.fetch_jwt()
 
+    @property
+    def jwt(self):
+        """JWT the client currently uses, e.g. to be handed over to worker processes."""
+        authorization = self.session.headers.get('authorization') or ''
+        return authorization[len('Bearer '):] or None
+
+    @span('login')
     def fetch_jwt(self):
         """Fetch user's JWT to be used when making Packt API requests."""
+        credentials = dict(self.credentials)
+        if self.recaptcha is not None:
+            with span('captcha_wait'):
+                credentials['recaptcha'] = self.recaptcha() if callable(self.recaptcha) else self.recaptcha
+        response = self.send('post', PACKT_API_LOGIN_URL, json=credentials, headers={'authorization': None})
         try:
-            response = requests.post(PACKT_API_LOGIN_URL, json=self.credentials)
             jwt = response.json().get('data').get('access')
-            self.session.headers.update({'authorization': 'Bearer {}'.format(jwt)})
-            logger.info('JWT token has been fetched successfully!')
         except Exception:
-            logger.error('Fetching JWT token failed!')
+            logger.error('Fetching JWT token failed with status {}!'.format(response.status_code))
+            raise PacktAuthenticationError('Packt API refused to log in with status {}: {}'.format(
+                response.status_code,
+                response.text[:200]
+            ))
+        self.session.headers.update({'authorization': 'Bearer {}'.format(jwt)})
+        logger.info('JWT token has been fetched successfully!')
+
+    def send(self, method, url, **kwargs):
+        """
+        Make a request within concurrency limit of its host, shared by all users of the client.
+
+        Requests failing due to host overload (429 or 5xx responses, connection errors) are retried with
+        exponential backoff or after time asked for by Retry-After header.
+        """
+        limiter = self.rate_limiter.for_url(url)
+        for attempt in range(MAX_RETRIES + 1):
+            limiter.acquire()
+            count('requests')
+            start = time.perf_counter()
+            latency = None
+            overloaded = False
+            try:
+                response = self.session.request(method, url, **kwargs)
+                latency = time.perf_counter() - start
+                overloaded = response.status_code == 429 or response.status_code >= 500
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                overloaded = True
+                if attempt == MAX_RETRIES:
+                    raise
+                retry_after = None
+            else:
+                if not overloaded or attempt == MAX_RETRIES:
+                    return response
+                retry_after = self._get_retry_after(response)
+            finally:
+                # Released whatever the outcome is, e.g. also for an invalid URL, or the slot would be lost for good.
+                limiter.release(latency, overloaded=overloaded)
+            delay = retry_after if retry_after is not None else RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+            logger.info('Retrying {} request to {} in {:.1f} s.'.format(method.upper(), url, delay))
+            count('retries')
+            limiter.pause(delay)
+
+    @staticmethod
+    def _get_retry_after(response):
+        try:
+            return min(float(response.headers['retry-after']), MAX_RETRY_AFTER)
+        except (KeyError, ValueError):
+            return None
 
     def request(self, method, url, **kwargs):
         """Make a request to a Packt API."""
-        response = self.session.request(method, url, **kwargs)
+        response = self.send(method, url, **kwargs)
         if response.status_code == 401:
             # Fetch a new JWT as the old one has expired and update session headers
             self.fetch_jwt()
-            return self.session.request(method, url, **kwargs)
+            return self.send(method, url, **kwargs)
         else:
             return response
 
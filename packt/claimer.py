@@ -1,5 +1,5 @@
 import datetime as dt
-from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from math import ceil
 from operator import itemgetter
 
@@ -11,30 +11,74 @@ from .api import (
     PACKT_API_USER_URL,
     PACKT_PRODUCT_SUMMARY_URL
 )
+from .downloader import PacktConnectionError
 from .utils.logger import get_logger
+from .utils.timing import span
 
 logger = get_logger(__name__)
 
 
-def get_all_books_data(api_client):
-    """Fetch all user's ebooks data."""
+API_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class PacktClaimError(Exception):
+    """Error raised when Packt API rejects a claim of Free Learning offer, e.g. due to a refused ReCAPTCHA."""
+    pass
+
+
+def parse_api_datetime(value):
+    """Return naive UTC datetime parsed from Packt API timestamp like '2020-03-20T10:11:12.000Z'."""
+    try:
+        return dt.datetime.strptime(value[:19], API_DATETIME_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def iter_books_data(api_client, claimed_after=None):
+    """
+    Yield user's ebooks data page by page, newest first.
+
+    The next page is fetched in background while books of the current one are being consumed, so e.g. downloads
+    start as soon as the first page arrives. Books are fetched newest first, so with `claimed_after` set fetching
+    stops at the first page reaching older books and only books claimed after that time are yielded.
+    """
     logger.info("Getting your books data...")
+    response = api_client.get(PACKT_API_PRODUCTS_URL)
+    pages_total = int(ceil(response.json().get('count') / DEFAULT_PAGINATION_SIZE))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        next_page = executor.submit(get_single_page_books_data, api_client, 0) if pages_total else None
+        # Books claimed while paging shift the following pages, so duplicates may appear only on adjacent pages.
+        previous_page_ids = set()
+        for page in range(pages_total):
+            page_books_data = next_page.result()
+            if page_books_data is None:
+                raise PacktConnectionError('Couldn\'t fetch page {} of user\'s books data.'.format(page))
+            reached_older_books = claimed_after is not None and any(
+                book['claimed_at'] is not None and book['claimed_at'] <= claimed_after for book in page_books_data
+            )
+            if page + 1 < pages_total and not reached_older_books:
+                next_page = executor.submit(get_single_page_books_data, api_client, page + 1)
+            for book in page_books_data:
+                if claimed_after is not None and (book['claimed_at'] or dt.datetime.max) <= claimed_after:
+                    continue
+                if book['id'] not in previous_page_ids:
+                    yield book
+            previous_page_ids = {book['id'] for book in page_books_data}
+            if reached_older_books:
+                break
+    logger.info('Books data has been successfully fetched.')
+
+
+def get_all_books_data(api_client, claimed_after=None):
+    """Fetch all user's ebooks data, see `iter_books_data`."""
     try:
-        response = api_client.get(PACKT_API_PRODUCTS_URL)
-        pages_total = int(ceil(response.json().get('count') / DEFAULT_PAGINATION_SIZE))
-
-        ids, my_books_data = (set(), [])
-        for book in chain(*map(lambda page: get_single_page_books_data(api_client, page), range(pages_total))):
-            if book['id'] not in ids:
-                ids.add(book['id'])
-                my_books_data.append(book)
-
-        logger.info('Books data has been successfully fetched.')
-        return my_books_data
-    except (AttributeError, TypeError):
+        return list(iter_books_data(api_client, claimed_after))
+    except (AttributeError, TypeError, PacktConnectionError):
         logger.error('Couldn\'t fetch user\'s books data.')
 
 
+@span('library_page')
 def get_single_page_books_data(api_client, page):
     """Fetch ebooks data from single products API pagination page."""
     try:
@@ -46,16 +90,36 @@ def get_single_page_books_data(api_client, page):
                 'limit': DEFAULT_PAGINATION_SIZE
             }
         )
-        return [{'id': t['productId'], 'title': t['productName']} for t in response.json().get('data')]
+        return [
+            {'id': t['productId'], 'title': t['productName'], 'claimed_at': parse_api_datetime(t.get('createdAt'))}
+            for t in response.json().get('data')
+        ]
     except Exception:
         logger.error('Couldn\'t fetch page {} of user\'s books data.'.format(page))
 
 
+def get_offer_day_start(now=None):
+    """Return start (UTC midnight) of the day the current Free Learning offer belongs to."""
+    now = now or dt.datetime.utcnow()
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def get_next_offer_rollover(now=None):
+    """Return UTC time at which the next Free Learning offer becomes available."""
+    return get_offer_day_start(now) + dt.timedelta(days=1)
+
+
+@span('claim')
 def claim_product(api_client, recaptcha_solution):
-    """Grab Packt Free Learning ebook."""
+    """
+    Grab Packt Free Learning ebook.
+
+    `recaptcha_solution` may be a callable returning the solution, it is then called only right before claiming,
+    so that ReCAPTCHA can be solved in background while offer and library data are being fetched.
+    """
     logger.info("Start grabbing ebook...")
 
-    utc_today = dt.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    utc_today = get_offer_day_start()
     offer_response = api_client.get(
         PACKT_API_FREE_LEARNING_OFFERS_URL,
         params={
@@ -83,10 +147,14 @@ def claim_product(api_client, recaptcha_solution):
     product_data = {'id': product_id, 'title': product_response.json()['title']}\
         if product_response.status_code == 200 else None
 
-    if any(product_id == book['id'] for book in get_all_books_data(api_client)):
+    # Library is fetched lazily and newest first, an already claimed offer is found on the first page.
+    if any(product_id == book['id'] for book in iter_books_data(api_client)):
         logger.info('You have already claimed Packt Free Learning "{}" offer.'.format(product_data['title']))
         return product_data
 
+    if callable(recaptcha_solution):
+        with span('captcha_wait'):
+            recaptcha_solution = recaptcha_solution()
     claim_response = api_client.put(
         PACKT_API_FREE_LEARNING_CLAIM_URL.format(user_id=user_id, offer_id=offer_id),
         json={'recaptcha': recaptcha_solution}
@@ -98,5 +166,9 @@ def claim_product(api_client, recaptcha_solution):
         logger.info('You have already claimed Packt Free Learning "{}" offer.'.format(product_data['title']))
     else:
         logger.error('Claiming Packt Free Learning book has failed.')
+        raise PacktClaimError('Claiming Packt Free Learning "{}" offer failed with status {}.'.format(
+            product_data['title'] if product_data else product_id,
+            claim_response.status_code
+        ))
 
     return product_data
@@ -26,6 +26,14 @@ class ConfigurationModel(object):
         """Return AntiCaptcha API key."""
         return self.configuration.get("ANTICAPTCHA_DATA", 'key')
 
+    @property
+    def captcha_solver_settings(self):
+        """Return captcha solver backend name and options passed to it, anti-captcha.com is used by default."""
+        options = dict(self.configuration.items("ANTICAPTCHA_DATA"))
+        options.pop('key', None)
+        backend = options.pop('backend', 'anticaptcha')
+        return backend, options
+
     @property
     def config_download_data(self):
         """Return download configuration data."""
@@ -0,0 +1,153 @@
+"""Long-running mode claiming Free Learning offers right after they roll over and syncing library in between."""
+import datetime as dt
+import signal
+import threading
+import time
+
+from .api import PACKT_API_USER_URL
+from .claimer import claim_product, get_next_offer_rollover
+from .utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+CLAIM_DELAY = 60  # seconds after offer rollover, gives Packt a moment to publish the new offer
+CLAIM_RETRY_INTERVAL = 5 * 60
+CLAIM_RETRIES = 5
+PRESOLVE_MARGIN = 20  # seconds between expected ReCAPTCHA solution and the claim
+KEEPALIVE_INTERVAL = 15 * 60
+SYNC_INTERVAL = 6 * 60 * 60
+
+
+class PacktDaemon(object):
+    """
+    Stays resident and keeps API session warm, claims each new Free Learning offer right after the UTC-midnight
+    rollover and runs library sync on a schedule in between.
+
+    `on_claimed(product_data)` is called after each successful claim, `on_claim_failure(exception)` after a claim
+    failed for the last time and `sync(stopped)` every `sync_interval` seconds, it should return between books once
+    `stopped()` returns true. `on_job_finished(job)` is called after each claim and sync job, e.g. to write the run
+    report. Claiming is disabled when `recaptcha_pool` is None. SIGINT and SIGTERM stop the daemon once the currently
+    running job is finished (a sync after the book being downloaded), the second signal stops it right away.
+    """
+
+    def __init__(self, api_client, recaptcha_pool=None, on_claimed=None, on_claim_failure=None, sync=None,
+                 sync_interval=SYNC_INTERVAL, claim_delay=CLAIM_DELAY, on_job_finished=None):
+        self.api_client = api_client
+        self.recaptcha_pool = recaptcha_pool
+        self.on_claimed = on_claimed
+        self.on_claim_failure = on_claim_failure
+        self.sync = sync
+        self.sync_interval = sync_interval
+        self.claim_delay = claim_delay
+        self.on_job_finished = on_job_finished
+        self._stop_event = threading.Event()
+        self._schedule = {}
+        self._claim_retries = CLAIM_RETRIES
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def stop(self, signum=None, _=None):
+        """Stop the daemon, can be used as a signal handler."""
+        if signum is not None:
+            logger.warning('Daemon stops after the current job, signal it again to stop right away.')
+            signal.signal(signum, signal.default_int_handler if signum == signal.SIGINT else signal.SIG_DFL)
+        self._stop_event.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+    def next_claim_time(self):
+        """Return timestamp of the first claim attempt of the next offer."""
+        rollover = get_next_offer_rollover().replace(tzinfo=dt.timezone.utc)
+        return rollover.timestamp() + self.claim_delay
+
+    def presolve_time(self, claim_time):
+        """Return timestamp at which ReCAPTCHA solving has to start to be solved shortly before `claim_time`."""
+        return claim_time - self.recaptcha_pool.solver.expected_solve_time - PRESOLVE_MARGIN
+
+    def claim(self):
+        product_data = claim_product(self.api_client, self.recaptcha_pool.get)
+        if self.on_claimed is not None:
+            self.on_claimed(product_data)
+
+    def keep_alive(self):
+        """Make a cheap API request, so that an expired JWT gets refreshed before it is needed."""
+        self.api_client.get(PACKT_API_USER_URL)
+        logger.info('Rate limits: {}'.format(self.api_client.rate_limiter.state()))
+
+    def run_job(self, name, job):
+        """Run job logging its failure, return the exception it failed with or None."""
+        try:
+            logger.info('Daemon runs {} job.'.format(name))
+            job()
+        except Exception as e:
+            logger.error('Daemon {} job failed with an exception {}'.format(name, e))
+            return e
+
+    def _job_finished(self, job):
+        if self.on_job_finished is not None:
+            self.run_job('{} finishing'.format(job), lambda: self.on_job_finished(job))
+
+    def _schedule_claim(self, claim_time):
+        self._schedule['claim'] = claim_time
+        self._schedule['presolve'] = self.presolve_time(claim_time)
+
+    def _presolve_job(self):
+        self.recaptcha_pool.prefetch()
+        self._schedule['presolve'] = float('inf')
+
+    def _claim_job(self):
+        error = self.run_job('claim', self.claim)
+        self._job_finished('claim')
+        if error is not None and self._claim_retries > 0:
+            self._claim_retries -= 1
+            self._schedule_claim(time.time() + CLAIM_RETRY_INTERVAL)
+            return
+        if error is not None and self.on_claim_failure is not None:
+            self.run_job('claim failure report', lambda: self.on_claim_failure(error))
+        self._claim_retries = CLAIM_RETRIES
+        self._schedule_claim(self.next_claim_time())
+
+    def _sync_job(self):
+        self.run_job('sync', lambda: self.sync(lambda: self.stopped))
+        self._job_finished('sync')
+        self._schedule['sync'] = time.time() + self.sync_interval
+
+    def _keep_alive_job(self):
+        self.run_job('keep_alive', self.keep_alive)
+        self._schedule['keep_alive'] = time.time() + KEEPALIVE_INTERVAL
+
+    def run(self, claim_now=True):
+        """Run scheduled jobs until the daemon is stopped."""
+        self.install_signal_handlers()
+        jobs = {
+            'presolve': self._presolve_job,
+            'claim': self._claim_job,
+            'sync': self._sync_job,
+            'keep_alive': self._keep_alive_job
+        }
+        now = time.time()
+        self._schedule = {'keep_alive': now + KEEPALIVE_INTERVAL}
+        if self.recaptcha_pool is not None:
+            self._schedule_claim(now if claim_now else self.next_claim_time())
+        if self.sync is not None:
+            self._schedule['sync'] = now
+        self._claim_retries = CLAIM_RETRIES
+        logger.success('Daemon started.')
+
+        while not self.stopped:
+            job, at = min(self._schedule.items(), key=lambda item: item[1])
+            wait_time = at - time.time()
+            if wait_time > 0:
+                logger.info('Daemon waits {:.0f} s for {} job.'.format(wait_time, job))
+                self._stop_event.wait(wait_time)
+            else:
+                jobs[job]()
+
+        logger.info('Stopping daemon...')
+        if self.recaptcha_pool is not None:
+            self.recaptcha_pool.shutdown()
+        logger.success('Daemon stopped.')
@@ -2,28 +2,44 @@ import os
 import re
 import sys
 import time
+from collections import namedtuple
 
 import requests
 from requests.exceptions import ConnectionError
-from slugify import slugify
 
 from .api import (
     PACKT_API_PRODUCT_FILE_DOWNLOAD_URL,
     PACKT_API_PRODUCT_FILE_TYPES_URL
 )
 from .utils.logger import get_logger
+from .utils.timing import count, span
 
 
 logger = get_logger(__name__)
 
 
+DOWNLOADED = 'downloaded'
+EXISTING = 'existing'
+FAILED = 'failed'
+
+
 class PacktConnectionError(ConnectionError):
     """Error raised whenever fetching data from Packt API fails."""
     pass
 
 
+class DownloadResult(namedtuple('DownloadResult', 'product_id title format path status bytes error')):
+    """Outcome of downloading a single product file, `status` is one of DOWNLOADED, EXISTING or FAILED."""
+
+    @property
+    def ready(self):
+        """Whether the file is available under `path`."""
+        return self.status in (DOWNLOADED, EXISTING)
+
+
 def slugify_product_name(title):
     """Return book title with spaces replaced by underscore and unicodes replaced by characters valid in filenames."""
+    from slugify import slugify  # imported lazily as it pulls in unicode transliteration tables
     return slugify(
         title,
         separator='_',
@@ -71,12 +87,66 @@ def get_product_download_urls(api_client, product_id):
         raise PacktConnectionError(error_message)
 
 
-def download_products(api_client, download_directory, formats, product_list, into_folder=False):
-    """Download selected products."""
+def download_file(api_client, download_url, full_file_path, temp_file_path, show_progress=False):
+    """Download product file from given Packt API download URL, return number of downloaded bytes."""
+    file_url = api_client.get(download_url).json().get('data')
+    r = api_client.get(file_url, timeout=100, stream=True)
+    if r.status_code != 200:
+        raise requests.exceptions.RequestException('Download of {} failed with status {}.'.format(
+            full_file_path,
+            r.status_code
+        ))
+    downloaded_bytes = 0
+    try:
+        with open(temp_file_path, 'wb') as f:
+            total_length = int(r.headers.get('content-length'))
+            num_of_chunks = (total_length / 1024) + 1
+            for num, chunk in enumerate(r.iter_content(chunk_size=1024)):
+                if chunk:
+                    if show_progress:
+                        update_download_progress_bar(num / num_of_chunks)
+                    f.write(chunk)
+                    f.flush()
+                    downloaded_bytes += len(chunk)
+            if show_progress:
+                update_download_progress_bar(-1)  # add end of line
+        os.rename(temp_file_path, full_file_path)
+    finally:
+        if os.path.isfile(temp_file_path):
+            os.remove(temp_file_path)
+        count('bytes_downloaded', downloaded_bytes)
+    return downloaded_bytes
+
+
+def download_products(api_client, download_directory, formats, product_list, into_folder=False, events=None,
+                      stopped=None):
+    """
+    Download selected products, return list of `DownloadResult`s.
+
+    Results of files available under the given path (downloaded or already existing ones) are emitted
+    to `events` as soon as each file lands, so that they can be processed while next files are being downloaded.
+    Once `stopped()` returns true no further product is started.
+    """
+    results = []
     nr_of_books_downloaded = 0
     is_interactive = sys.stdout.isatty()
+
+    def add_result(result):
+        results.append(result)
+        if events is not None and result.ready:
+            events.emit(result)
+
     for book in product_list:
-        download_urls = get_product_download_urls(api_client, book['id'])
+        if stopped is not None and stopped():
+            logger.info('Downloading stopped before "{}" ebook.'.format(book['title']))
+            break
+        try:
+            with span('resolve_urls', product_id=book['id']):
+                download_urls = get_product_download_urls(api_client, book['id'])
+        except Exception as e:
+            logger.error('Couldn\'t fetch download URLs of "{}" ebook: {}'.format(book['title'], e))
+            add_result(DownloadResult(book['id'], book['title'], None, None, FAILED, 0, e))
+            continue
         for format, download_url in download_urls.items():
             if format in formats and not (format == 'code' and 'video' in download_urls and 'video' in formats):
                 file_extention = 'zip' if format in ('video', 'code') else format
@@ -89,9 +159,11 @@ def download_products(api_client, download_directory, formats, product_list, int
                 else:
                     target_download_path = os.path.join(download_directory)
                 full_file_path = os.path.join(target_download_path, '{}.{}'.format(file_name, file_extention))
-                temp_file_path = os.path.join(target_download_path, 'download.tmp')
+                # Unique per file, so that several workers can download into the same directory at once.
+                temp_file_path = os.path.join(target_download_path, '.{}.{}.download'.format(file_name, file_extention))
                 if os.path.isfile(full_file_path):
                     logger.info('"{}.{}" already exists under the given path.'.format(file_name, file_extention))
+                    add_result(DownloadResult(book['id'], book['title'], format, full_file_path, EXISTING, 0, None))
                 else:
                     if format == 'code':
                         logger.info('Downloading code for ebook: "{}"...'.format(book['title']))
@@ -100,41 +172,36 @@ def download_products(api_client, download_directory, formats, product_list, int
                     else:
                         logger.info('Downloading ebook: "{}" in {} format...'.format(book['title'], format))
                     try:
-                        file_url = api_client.get(download_url).json().get('data')
-                        r = api_client.get(file_url, timeout=100, stream=True)
-                        if r.status_code == 200:
-                            try:
-                                with open(temp_file_path, 'wb') as f:
-                                    total_length = int(r.headers.get('content-length'))
-                                    num_of_chunks = (total_length / 1024) + 1
-                                    for num, chunk in enumerate(r.iter_content(chunk_size=1024)):
-                                        if chunk:
-                                            if is_interactive:
-                                                update_download_progress_bar(num / num_of_chunks)
-                                            f.write(chunk)
-                                            f.flush()
-                                    if is_interactive:
-                                        update_download_progress_bar(-1)  # add end of line
-                                os.rename(temp_file_path, full_file_path)
-                            finally:
-                                if os.path.isfile(temp_file_path):
-                                    os.remove(temp_file_path)
-
-                            if format == 'code':
-                                logger.success('Code for ebook "{}" downloaded successfully!'.format(book['title']))
-                            else:
-                                logger.success('Ebook "{}" in {} format downloaded successfully!'.format(
-                                    book['title'],
-                                    format
-                                ))
-                            nr_of_books_downloaded += 1
+                        with span('download', product_id=book['id'], format=format) as download_span:
+                            download_span.attrs['bytes'] = download_file(
+                                api_client,
+                                download_url,
+                                full_file_path,
+                                temp_file_path,
+                                show_progress=is_interactive
+                            )
+                        if format == 'code':
+                            logger.success('Code for ebook "{}" downloaded successfully!'.format(book['title']))
                         else:
-                            message = 'Couldn\'t download "{}" ebook in {} format.'.format(book['title'], format)
-                            logger.error(message)
-                            raise requests.exceptions.RequestException(message)
+                            logger.success('Ebook "{}" in {} format downloaded successfully!'.format(
+                                book['title'],
+                                format
+                            ))
+                        nr_of_books_downloaded += 1
+                        add_result(DownloadResult(
+                            book['id'],
+                            book['title'],
+                            format,
+                            full_file_path,
+                            DOWNLOADED,
+                            download_span.attrs['bytes'],
+                            None
+                        ))
                     except Exception as e:
-                        logger.error(e)
+                        logger.error('Couldn\'t download "{}" ebook in {} format: {}'.format(book['title'], format, e))
+                        add_result(DownloadResult(book['id'], book['title'], format, full_file_path, FAILED, 0, e))
     logger.info("{} ebooks have been downloaded!".format(str(nr_of_books_downloaded)))
+    return results
 
 
 def update_download_progress_bar(current_work_done):
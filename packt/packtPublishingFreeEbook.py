@@ -1,14 +1,11 @@
 import click
 import datetime as dt
 import os
+import re
 import sys
 
-from .api import PacktAPIClient
-from .claimer import claim_product, get_all_books_data
-from .configuration import ConfigurationModel
-from .downloader import download_products, slugify_product_name
-from .utils.anticaptcha import solve_recaptcha
-from .utils.logger import get_logger
+from .utils.logger import get_logger, setup_logging
+from .utils.timing import get_run_report, span
 
 logger = get_logger(__name__)
 
@@ -20,9 +17,17 @@ FAILURE_EMAIL_SUBJECT = "{} Grabbing a new free Packt ebook failed"
 FAILURE_EMAIL_BODY = "Today's free Packt ebook grabbing has failed with exception: {}!\n\nCheck this out!"
 
 AVAILABLE_DOWNLOAD_FORMATS = ('pdf', 'mobi', 'epub', 'video', 'code')
+RUN_REPORT_FILE_NAME = 'RUN_REPORT.json'
 
-PACKT_URL = 'https://www.packtpub.com/'
-PACKT_RECAPTCHA_SITE_KEY = '6LeAHSgUAAAAAKsn5jo6RUSTLVxGNYyuvUcLMe0_'
+
+def validate_title_pattern(ctx, param, value):
+    """Reject --title which isn't a valid regular expression before anything is set up."""
+    if value is not None:
+        try:
+            re.compile(value)
+        except re.error as e:
+            raise click.BadParameter('invalid regular expression: {}'.format(e))
+    return value
 
 
 @click.command()
@@ -46,26 +51,134 @@ PACKT_RECAPTCHA_SITE_KEY = '6LeAHSgUAAAAAKsn5jo6RUSTLVxGNYyuvUcLMe0_'
     default=False,
     help='See Google Drive API Setup section in README.'
 )
-def packt_cli(cfgpath, grab, grabd, dall, sgd, mail, status_mail, folder, noauth_local_webserver):
+@click.option('--log-json', is_flag=True, default=False, help='Write log file as JSON lines.')
+@click.option(
+    '--daemon',
+    is_flag=True,
+    default=False,
+    help='Keep running, claim each new ebook right after the offer rollover and sync your library periodically.'
+)
+@click.option(
+    '--report',
+    default=os.path.join(os.getcwd(), RUN_REPORT_FILE_NAME),
+    type=click.Path(dir_okay=False, writable=True),
+    help='Path of JSON report with timings of run phases written at the end of each run.'
+)
+@click.option(
+    '--trace',
+    default=None,
+    type=click.Path(dir_okay=False, writable=True),
+    help='Also write run phases as trace events viewable e.g. in chrome://tracing.'
+)
+@click.option(
+    '--claimed-after',
+    default=None,
+    type=click.DateTime(formats=['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S']),
+    help='With -da download only ebooks claimed after given UTC date.'
+)
+@click.option(
+    '--title',
+    default=None,
+    callback=validate_title_pattern,
+    help='With -da download only ebooks with title matching given regex.'
+)
+@click.option('--product-id', multiple=True, help='With -da download only ebooks with given id, may be repeated.')
+@click.option(
+    '--new-only',
+    is_flag=True,
+    default=False,
+    help='With -da download only ebooks claimed after the newest ebook of the last successful sync.'
+)
+@click.option(
+    '--workers',
+    default=1,
+    type=click.IntRange(min=1),
+    help='With -da download ebooks by given number of worker processes.'
+)
+@click.option(
+    '--shards',
+    default=None,
+    type=click.IntRange(min=1),
+    help='With -da split ebooks into given number of shards synced by workers (defaults to number of workers).'
+)
+@click.option(
+    '--run-id',
+    default=None,
+    help='With --shards id of the sharded sync shared by workers on all hosts syncing into the same download folder.'
+)
+def packt_cli(cfgpath, grab, grabd, dall, sgd, mail, status_mail, folder, noauth_local_webserver, log_json, daemon,
+              report, trace, claimed_after, title, product_id, new_only, workers, shards, run_id):
+    if daemon and not (grab or grabd or dall or sgd or mail):
+        raise click.UsageError('--daemon needs at least one of -g, -gd, -da, -sgd or -m options.')
+    if (claimed_after or title is not None or product_id or new_only) and not dall:
+        raise click.UsageError('--claimed-after, --title, --product-id and --new-only need -da option.')
+    shards = shards or workers
+    if shards > 1 and not dall:
+        raise click.UsageError('--workers and --shards need -da option.')
+    if shards > 1 and daemon:
+        raise click.UsageError('--workers and --shards can\'t be combined with --daemon.')
+    setup_logging(json_lines=log_json)
+    # Heavy dependencies are imported here, so that e.g. `--help` doesn't have to wait for them.
+    from .api import PACKT_RECAPTCHA_SITE_KEY, PACKT_URL, PacktAPIClient
+    from .claimer import claim_product, iter_books_data
+    from .configuration import ConfigurationModel
+    from .downloader import download_products
+    from .pipeline import DownloadEvents
+    from .selection import BookFilter, SyncState
+    from .utils.anticaptcha import RecaptchaPool, get_solver
+
     config_file_path = cfgpath
     into_folder = folder
 
+    def send_status_mail(subject, body):
+        from .utils.mail import MailBook
+        mb = MailBook(config_file_path)
+        mb.send_info(subject=subject, body=body)
+
+    def send_failure_mail(exception):
+        send_status_mail(
+            subject=FAILURE_EMAIL_SUBJECT.format(dt.datetime.now().strftime(DATE_FORMAT)),
+            body=FAILURE_EMAIL_BODY.format(str(exception))
+        )
+
+    daemon_jobs_reported = False
+
+    def write_report(job=None):
+        """Write the run report, after a daemon's `job` also start a new report for the next job."""
+        nonlocal daemon_jobs_reported
+        try:
+            get_run_report().write(report, trace)
+        except OSError as e:
+            logger.error('Writing run report failed: {}'.format(e))
+        if job is not None:
+            get_run_report().reset()
+            daemon_jobs_reported = True
+
+    recaptcha_pool = None
     try:
         cfg = ConfigurationModel(config_file_path)
-        product_data = None
-        recaptcha_solution = solve_recaptcha(cfg.anticaptcha_api_key, PACKT_URL, PACKT_RECAPTCHA_SITE_KEY)
-        api_client = PacktAPIClient({'recaptcha': recaptcha_solution, **cfg.packt_login_credentials})
+        claim = grab or grabd or sgd or mail
 
-        # Grab the newest book
-        if grab or grabd or sgd or mail:
-            product_data = claim_product(api_client, recaptcha_solution)
+        # Logging in needs a ReCAPTCHA solution, solve it in background while the rest of the setup goes on.
+        # Claiming needs another one, it's solved only once the offer turns out not to be claimed yet (the daemon
+        # solves it shortly before each claim), so that e.g. a retried run doesn't pay for an unused solution.
+        backend, solver_options = cfg.captcha_solver_settings
+        solver = get_solver(backend, cfg.anticaptcha_api_key, **solver_options)
+        recaptcha_pool = RecaptchaPool(solver, PACKT_URL, PACKT_RECAPTCHA_SITE_KEY)
+        recaptcha_pool.prefetch()
+        if grabd or dall or sgd or mail:
+            download_directory, formats = cfg.config_download_data
+            formats = formats or AVAILABLE_DOWNLOAD_FORMATS
+
+        api_client = PacktAPIClient(cfg.packt_login_credentials, recaptcha=recaptcha_pool.get)
+        get_run_report().add_section('rate_limits', api_client.rate_limiter.state)
 
+        def handle_claimed_product(product_data):
+            """Report, download and deliver a claimed product according to selected options."""
             # Send email about successful book grab. Do it only when book
             # isn't going to be emailed as we don't want to send email twice.
             if status_mail and not mail:
-                from .utils.mail import MailBook
-                mb = MailBook(config_file_path)
-                mb.send_info(
+                send_status_mail(
                     subject=SUCCESS_EMAIL_SUBJECT.format(
                         dt.datetime.now().strftime(DATE_FORMAT),
                         product_data['title']
@@ -73,61 +186,106 @@ def packt_cli(cfgpath, grab, grabd, dall, sgd, mail, status_mail, folder, noauth
                     body=SUCCESS_EMAIL_BODY.format(product_data['title'])
                 )
 
-        # Download book(s) into proper location.
-        if grabd or dall or sgd or mail:
-            download_directory, formats = cfg.config_download_data
-            download_directory = download_directory if (dall or grabd) else os.getcwd()  # cwd for temporary downloads
-            formats = formats or AVAILABLE_DOWNLOAD_FORMATS
-
-            if dall:
-                download_products(
-                    api_client,
-                    download_directory,
-                    formats,
-                    get_all_books_data(api_client),
-                    into_folder=into_folder
-                )
-            elif grabd:
+            # Download book into proper location.
+            if grabd:
                 download_products(api_client, download_directory, formats, [product_data], into_folder=into_folder)
-            else:  # sgd or mail
-                download_products(api_client, download_directory, formats, [product_data], into_folder=False)
-
-        # Send downloaded book(s) by mail or to Google Drive.
-        if sgd or mail:
-            paths = [
-                os.path.join(download_directory, path)
-                for path in os.listdir(download_directory)
-                if os.path.isfile(path) and slugify_product_name(product_data['title']) in path
-            ]
-            if sgd:
-                from .utils.google_drive import GoogleDriveManager
-                google_drive = GoogleDriveManager(config_file_path)
-                google_drive.send_files(paths)
-            else:
-                from .utils.mail import MailBook
-                mb = MailBook(config_file_path)
-                pdf_path = None
-                mobi_path = None
+            elif sgd or mail:
+                # Files are downloaded into cwd temporarily, each one is sent by mail or to Google Drive
+                # as soon as it lands and removed once it has been delivered.
+                def remove_file(result):
+                    with span('cleanup', file=os.path.basename(result.path)):
+                        os.remove(result.path)
+
+                events = DownloadEvents(on_processed=remove_file)
+                if sgd:
+                    from .utils.google_drive import GoogleDriveManager
+                    google_drive = GoogleDriveManager(config_file_path)
+                    events.subscribe(lambda result: google_drive.send_files([result.path]))
+                else:
+                    from .utils.mail import MailBook
+                    mb = MailBook(config_file_path)
+
+                    def mail_book(result):
+                        if result.format == 'pdf':
+                            mb.send_book(result.path)
+                        elif result.format == 'mobi':
+                            mb.send_kindle(result.path)
+                    events.subscribe(mail_book)
                 try:
-                    pdf_path = [path for path in paths if path.endswith('.pdf')][-1]
-                    mobi_path = [path for path in paths if path.endswith('.mobi')][-1]
-                except IndexError:
-                    pass
-                if pdf_path:
-                    mb.send_book(pdf_path)
-                if mobi_path:
-                    mb.send_kindle(mobi_path)
-            for path in paths:
-                os.remove(path)
+                    download_products(api_client, os.getcwd(), formats, [product_data], events=events)
+                finally:
+                    with span('delivery_wait'):
+                        failures = events.close()
+                if failures:
+                    raise failures[0][1]
+
+        book_filter = BookFilter(claimed_after, title, product_id)
+        synced = False
+
+        def sync_library(stopped=None):
+            """
+            Download books selected by filters from user's account, stopping between books once `stopped()` is true.
+
+            Books are filtered before any download URL is fetched, and with `--new-only` (and in daemon mode after
+            the first sync) fetching library stops at books older than the newest book of the last successful sync.
+            A sync selecting books by title or product id isn't stored as a successful one, as it skips other books,
+            neither is a stopped one.
+            """
+            nonlocal synced
+            sync_state = SyncState(download_directory)
+            fetch_claimed_after = book_filter.claimed_after
+            if new_only or synced:
+                fetch_claimed_after = sync_state.claimed_after(fetch_claimed_after)
+            # Books stream from library pages into downloads, the first transfer doesn't wait for the whole library.
+            books = iter_books_data(api_client, claimed_after=fetch_claimed_after)
+            books = filter(book_filter, books)
+            if not book_filter.is_partial:
+                books = sync_state.track(books)
+            if shards > 1:
+                from .sharding import sync_sharded
+                _, failed = sync_sharded(api_client, config_file_path, download_directory, formats, books, shards,
+                                         run_id, workers=workers, into_folder=into_folder)
+            else:
+                results = download_products(api_client, download_directory, formats, books, into_folder=into_folder,
+                                            stopped=stopped)
+                failed = len([result for result in results if not result.ready])
+            if failed:
+                logger.error('{} files failed to download, sync state is kept for the next sync.'.format(failed))
+            elif stopped is not None and stopped():
+                logger.warning('Sync has been stopped, sync state is kept for the next sync.')
+            elif not book_filter.is_partial:
+                sync_state.save()
+            synced = True
+
+        if daemon:
+            from .daemon import PacktDaemon
+            PacktDaemon(
+                api_client,
+                recaptcha_pool if claim else None,
+                on_claimed=handle_claimed_product,
+                on_claim_failure=send_failure_mail if status_mail else None,
+                sync=sync_library if dall else None,
+                on_job_finished=write_report
+            ).run()
+            return
+
+        # Grab the newest book
+        if claim:
+            handle_claimed_product(claim_product(api_client, recaptcha_pool.get))
+
+        # Download all books into proper location.
+        if dall:
+            sync_library()
 
         logger.success("Good, looks like all went well! :-)")
     except Exception as e:
         logger.error("Exception occurred {}".format(e))
         if status_mail:
-            from .utils.mail import MailBook
-            mb = MailBook(config_file_path)
-            mb.send_info(
-                subject=FAILURE_EMAIL_SUBJECT.format(dt.datetime.now().strftime(DATE_FORMAT)),
-                body=FAILURE_EMAIL_BODY.format(str(e))
-            )
+            send_failure_mail(e)
         sys.exit(2)
+    finally:
+        if recaptcha_pool is not None:
+            recaptcha_pool.shutdown()
+        # Report of the last daemon's job isn't overwritten by whatever happened between it and the shutdown.
+        if not daemon_jobs_reported:
+            write_report()
@@ -0,0 +1,62 @@
+"""Dispatching of finished downloads to stages processing them, e.g. Google Drive upload or mail delivery."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class DownloadEvents(object):
+    """
+    Passes each emitted `DownloadResult` to all subscribed handlers as soon as its file lands.
+
+    Each handler runs in its own worker thread and processes results in order they were emitted, so e.g. an upload
+    of one file overlaps with download of the next one. Once all handlers are done with a result,
+    `on_processed(result)` is called. Failures of handlers are logged and don't stop processing of other results.
+    """
+
+    def __init__(self, on_processed=None):
+        self.on_processed = on_processed
+        self.failures = []
+        self._handlers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, handler):
+        """Call `handler(result)` for each emitted result."""
+        self._handlers.append((handler, ThreadPoolExecutor(max_workers=1)))
+
+    def emit(self, result):
+        if not self._handlers:
+            self._processed(result)
+            return
+        remaining_handlers = [len(self._handlers)]
+        for handler, executor in self._handlers:
+            executor.submit(self._handle, handler, result, remaining_handlers)
+
+    def _handle(self, handler, result, remaining_handlers):
+        try:
+            handler(result)
+        except Exception as e:
+            logger.error('Processing of {} failed with an exception {}'.format(result.path, e))
+            with self._lock:
+                self.failures.append((result, e))
+        finally:
+            with self._lock:
+                remaining_handlers[0] -= 1
+                processed = remaining_handlers[0] == 0
+            if processed:
+                self._processed(result)
+
+    def _processed(self, result):
+        if self.on_processed is not None:
+            try:
+                self.on_processed(result)
+            except Exception as e:
+                logger.error('Finishing processing of {} failed with an exception {}'.format(result.path, e))
+
+    def close(self):
+        """Wait until all emitted results are processed, return list of (result, exception) handler failures."""
+        for _, executor in self._handlers:
+            executor.shutdown(wait=True)
+        return self.failures
@@ -0,0 +1,78 @@
+"""Selection of books synced from user's library, based on entitlement metadata."""
+import datetime as dt
+import json
+import os
+import re
+
+from .claimer import API_DATETIME_FORMAT
+from .utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+SYNC_STATE_FILE_NAME = '.packt_sync_state.json'
+
+
+class BookFilter(object):
+    """
+    Predicate selecting books by claim date, title regular expression and product ids.
+
+    Unset criteria match every book, set criteria have to be all met.
+    """
+
+    def __init__(self, claimed_after=None, title_pattern=None, product_ids=None):
+        self.claimed_after = claimed_after
+        self.title_regex = re.compile(title_pattern, re.IGNORECASE) if title_pattern else None
+        self.product_ids = frozenset(product_ids) if product_ids else None
+
+    @property
+    def is_partial(self):
+        """Whether books are selected by title or product id, so not all books claimed in its time range are."""
+        return self.title_regex is not None or self.product_ids is not None
+
+    def __call__(self, book):
+        if self.claimed_after is not None and book['claimed_at'] is not None \
+                and book['claimed_at'] <= self.claimed_after:
+            return False
+        if self.title_regex is not None and not self.title_regex.search(book['title']):
+            return False
+        if self.product_ids is not None and book['id'] not in self.product_ids:
+            return False
+        return True
+
+
+class SyncState(object):
+    """Claim time of the newest book synced into a download directory, stored in a file inside of it."""
+
+    def __init__(self, download_directory):
+        self.path = os.path.join(download_directory, SYNC_STATE_FILE_NAME)
+        self.last_claimed_at = None
+        self._newest = None
+        try:
+            with open(self.path) as f:
+                self.last_claimed_at = dt.datetime.strptime(json.load(f)['last_claimed_at'], API_DATETIME_FORMAT)
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error('Ignoring corrupted sync state file {}: {}'.format(self.path, e))
+
+    def claimed_after(self, claimed_after=None):
+        """Return the later of `claimed_after` and claim time of the newest synced book."""
+        return max(filter(None, (claimed_after, self.last_claimed_at)), default=None)
+
+    def track(self, books):
+        """Yield given books, remembering claim time of the newest of them to be stored by `save`."""
+        for book in books:
+            if book.get('claimed_at') is not None and (self._newest is None or book['claimed_at'] > self._newest):
+                self._newest = book['claimed_at']
+            yield book
+
+    def save(self):
+        """Store claim time of the newest of tracked books, call it once they have been successfully synced."""
+        if self._newest is None or (self.last_claimed_at is not None and self._newest <= self.last_claimed_at):
+            return
+        self.last_claimed_at = self._newest
+        # Written atomically, as several workers of a sharded sync may save it into a shared directory at once.
+        temp_path = '{}.{}'.format(self.path, os.getpid())
+        with open(temp_path, 'w') as f:
+            json.dump({'last_claimed_at': self.last_claimed_at.strftime(API_DATETIME_FORMAT)}, f)
+        os.replace(temp_path, self.path)
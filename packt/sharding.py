@@ -0,0 +1,306 @@
+"""Library sync split into shards downloaded by several worker processes, possibly running on several hosts."""
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import time
+import uuid
+import zlib
+
+from .downloader import download_products
+from .utils.lease import LEASE_TTL, Heartbeat, Lease, new_owner_id
+from .utils.logger import forward_worker_logs, get_logger, setup_worker_logging
+from .utils.timing import get_run_report, span
+
+logger = get_logger(__name__)
+
+SHARDS_DIRECTORY_NAME = '.packt_shards'
+WORKER_POLL_INTERVAL = 1.0  # seconds between checks whether local worker processes are still alive
+
+
+def shard_of(product_id, shards):
+    """Return index of the shard a product belongs to, the same in every process and on every host."""
+    return zlib.crc32(product_id.encode('utf-8')) % shards
+
+
+class ShardedSync(object):
+    """
+    Download of books split by product id hash into `shards` shards, coordinated through leases
+    in `download_directory`.
+
+    Any number of workers sharing the download directory (e.g. over NFS) and `run_id` can take part: each of them
+    leases a shard which isn't done yet, downloads its books and marks the shard done. Leases of crashed workers expire
+    and their shards are taken over by the others. Books are leased one by one as well, so a book is never downloaded
+    by two workers at once, even when a stalled worker's shard has been taken over. Shards marked done are skipped,
+    so running again with the same `run_id` resumes an interrupted sync.
+    """
+
+    def __init__(self, download_directory, shards, run_id, owner=None, lease_ttl=LEASE_TTL):
+        self.download_directory = download_directory
+        self.shards = shards
+        self.run_id = run_id
+        self.directory = os.path.join(download_directory, SHARDS_DIRECTORY_NAME, run_id)
+        self.owner = owner or new_owner_id()
+        self.lease_ttl = lease_ttl
+        os.makedirs(os.path.join(self.directory, 'books'), exist_ok=True)
+
+    def _shard_path(self, shard, extension):
+        return os.path.join(self.directory, 'shard-{}-of-{}.{}'.format(shard, self.shards, extension))
+
+    def is_done(self, shard):
+        return os.path.exists(self._shard_path(shard, 'done'))
+
+    def is_complete(self):
+        return all(self.is_done(shard) for shard in range(self.shards))
+
+    def mark_done(self, shard, results):
+        done_path = self._shard_path(shard, 'done')
+        temp_path = '{}.{}'.format(done_path, self.owner)
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'owner': self.owner,
+                'files': len(results),
+                'failed': len([result for result in results if not result.ready])
+            }, f)
+        os.replace(temp_path, done_path)
+
+    def failed_files(self):
+        """Return number of files which failed to download in all shards done so far, by any worker."""
+        failed = 0
+        for shard in range(self.shards):
+            try:
+                with open(self._shard_path(shard, 'done')) as f:
+                    failed += json.load(f)['failed']
+            except FileNotFoundError:
+                pass
+        return failed
+
+    def break_leases(self, owner):
+        """Break leases of a worker known to be dead, instead of waiting for them to expire."""
+        for directory in (self.directory, os.path.join(self.directory, 'books')):
+            for name in os.listdir(directory):
+                if not name.endswith('.lease'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    with open(path) as f:
+                        if f.read() != owner:
+                            continue
+                    os.remove(path)
+                    logger.info('Broke lease {} of dead worker {}.'.format(path, owner))
+                except OSError:
+                    pass
+
+    def remove(self):
+        """Remove coordination files of the sync, once it's done."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(self.directory))
+        except OSError:
+            pass  # other syncs are still using it
+
+    def run(self, api_client, formats, books, into_folder=False, first_shard=0):
+        """Sync shards until all of them are done, starting with `first_shard`; return results of own downloads."""
+        shard_books = [[] for _ in range(self.shards)]
+        for book in books:
+            shard_books[shard_of(book['id'], self.shards)].append(book)
+        leases = [Lease(self._shard_path(shard, 'lease'), self.owner, self.lease_ttl) for shard in range(self.shards)]
+        pending = [(first_shard + i) % self.shards for i in range(self.shards)]
+        results = []
+        with Heartbeat(self.lease_ttl / 4) as heartbeat:
+            while True:
+                pending = [shard for shard in pending if not self.is_done(shard)]
+                if not pending:
+                    break
+                synced = False
+                for shard in pending:
+                    lease = leases[shard]
+                    if not lease.acquire():
+                        continue
+                    heartbeat.add(lease)
+                    try:
+                        if not self.is_done(shard):
+                            results.extend(self._sync_shard(shard, lease, heartbeat, api_client, formats,
+                                                            shard_books[shard], into_folder))
+                            synced = True
+                    finally:
+                        heartbeat.discard(lease)
+                        lease.release()
+                if not synced:
+                    # Remaining shards are leased by other workers, wait until they finish or their leases expire.
+                    time.sleep(heartbeat.interval)
+        return results
+
+    def _sync_shard(self, shard, lease, heartbeat, api_client, formats, books, into_folder):
+        logger.info('Syncing shard {} of {} ({} books).'.format(shard + 1, self.shards, len(books)))
+        with span('shard', shard=shard, books=len(books)):
+            results = download_products(
+                api_client,
+                self.download_directory,
+                formats,
+                self._lease_books(books, lease, heartbeat),
+                into_folder=into_folder
+            )
+        if lease.held:
+            self.mark_done(shard, results)
+        else:
+            logger.warning('Shard {} of {} has been taken over before it was finished.'.format(shard + 1, self.shards))
+        return results
+
+    def _lease_books(self, books, shard_lease, heartbeat):
+        """Yield books of a shard while its lease is held, each of them is leased until the next one is requested."""
+        for book in books:
+            if not shard_lease.held:
+                return
+            lease = Lease(os.path.join(self.directory, 'books', '{}.lease'.format(book['id'])), self.owner,
+                          self.lease_ttl)
+            if not lease.wait(heartbeat.interval, cancelled=lambda: not shard_lease.held):
+                return
+            heartbeat.add(lease)
+            try:
+                yield book
+            finally:
+                heartbeat.discard(lease)
+                lease.release()
+
+
+def sync_worker(config_file_path, download_directory, formats, books, shards, run_id, into_folder, first_shard,
+                owner, jwt, limiter_options):
+    """
+    Run sharded sync in a worker process, return its results and run report.
+
+    The worker's API session starts with `jwt` of the parent process, it logs in (solving ReCAPTCHA) only once the JWT
+    expires. Its requests are limited by rate limiter with `limiter_options`, its share of the parent's limits.
+    """
+    from .api import PACKT_RECAPTCHA_SITE_KEY, PACKT_URL, PacktAPIClient
+    from .configuration import ConfigurationModel
+    from .utils.anticaptcha import get_solver
+    from .utils.rate_limiter import RateLimiter
+    cfg = ConfigurationModel(config_file_path)
+
+    def solve_recaptcha():
+        backend, solver_options = cfg.captcha_solver_settings
+        solver = get_solver(backend, cfg.anticaptcha_api_key, **solver_options)
+        return solver.solve_recaptcha(PACKT_URL, PACKT_RECAPTCHA_SITE_KEY)
+
+    api_client = PacktAPIClient(
+        cfg.packt_login_credentials,
+        rate_limiter=RateLimiter(**limiter_options),
+        recaptcha=solve_recaptcha,
+        jwt=jwt
+    )
+    get_run_report().add_section('rate_limits', api_client.rate_limiter.state)
+    sync = ShardedSync(download_directory, shards, run_id, owner=owner)
+    results = sync.run(api_client, formats, books, into_folder, first_shard)
+    # Exceptions may not be picklable, only their descriptions are sent to the parent process.
+    results = [result._replace(error=repr(result.error)) if result.error else result for result in results]
+    return results, get_run_report().to_dict()
+
+
+def run_worker(log_queue, outcome_queue, worker, sync_worker_args):
+    """Entry point of a worker process, puts `(worker, (results, report, error))` into `outcome_queue` when done."""
+    setup_worker_logging(log_queue)
+    try:
+        results, report = sync_worker(*sync_worker_args)
+        outcome_queue.put((worker, (results, report, None)))
+    except Exception as e:
+        logger.error('Worker {} failed with an exception {}'.format(worker, e))
+        outcome_queue.put((worker, ([], None, repr(e))))
+
+
+def _wait_for_workers(sync, processes, outcome_queue):
+    """
+    Return outcomes of worker processes by their index.
+
+    Leases of a worker which died without an outcome (e.g. killed for running out of memory) are broken right away,
+    so that its shards are taken over by the other workers without waiting for the leases to expire.
+    """
+    outcomes = {}
+    running = dict(processes)
+    dead = set()
+    while running:
+        try:
+            worker, outcome = outcome_queue.get(timeout=WORKER_POLL_INTERVAL)
+        except queue.Empty:
+            for worker, (process, owner) in list(running.items()):
+                if process.is_alive():
+                    continue
+                if worker not in dead:
+                    # Outcome of a worker which has just exited may still be on its way, check again next time.
+                    dead.add(worker)
+                    continue
+                logger.error('Worker {} died with exit code {}, its shards will be taken over.'.format(
+                    worker,
+                    process.exitcode
+                ))
+                sync.break_leases(owner)
+                outcomes[worker] = ([], None, 'exit code {}'.format(process.exitcode))
+                del running[worker]
+        else:
+            outcomes[worker] = outcome
+            if outcome[2] is not None:
+                sync.break_leases(running[worker][1])
+            del running[worker]
+    return outcomes
+
+
+def _run_workers(sync, api_client, config_file_path, formats, books, workers, into_folder):
+    """
+    Run sharded sync in `workers` spawned processes sharing login and request limits of `api_client`, return results
+    of their downloads.
+    """
+    limiter_options = api_client.rate_limiter.split_options(workers)
+    context = multiprocessing.get_context('spawn')
+    log_queue = context.Queue()
+    outcome_queue = context.Queue()
+    log_listener = forward_worker_logs(log_queue)
+    processes = {}
+    try:
+        for worker in range(workers):
+            owner = '{}-{}'.format(sync.owner, worker)
+            sync_worker_args = (config_file_path, sync.download_directory, formats, books, sync.shards, sync.run_id,
+                                into_folder, worker * sync.shards // workers, owner, api_client.jwt, limiter_options)
+            process = context.Process(
+                target=run_worker,
+                args=(log_queue, outcome_queue, worker, sync_worker_args),
+                name='packt-worker-{}'.format(worker)
+            )
+            process.start()
+            processes[worker] = (process, owner)
+        outcomes = _wait_for_workers(sync, processes, outcome_queue)
+    finally:
+        for process, _ in processes.values():
+            if process.is_alive():
+                process.terminate()
+            process.join()
+        log_listener.stop()
+    worker_reports = [outcomes[worker][1] for worker in sorted(outcomes)]
+    get_run_report().add_section('workers', lambda: worker_reports)
+    return [result for results, _, _ in outcomes.values() for result in results]
+
+
+def sync_sharded(api_client, config_file_path, download_directory, formats, books, shards, run_id=None, workers=1,
+                 into_folder=False):
+    """
+    Download `books` split into `shards` shards by `workers` local processes.
+
+    Workers on other hosts take part in the sync when started with the same `run_id`. Without `run_id` the sync
+    involves only this host and its coordination files are removed once it's done. Shards left over by workers which
+    failed are finished in this process using `api_client`, as is the whole sync with a single worker. Return results
+    of downloads made on this host and number of files which failed to download in all shards.
+    """
+    books = list(books)  # selected books are fetched from the library once and split among workers
+    sync = ShardedSync(download_directory, shards, run_id or uuid.uuid4().hex)
+    results = []
+    try:
+        if workers > 1:
+            results.extend(_run_workers(sync, api_client, config_file_path, formats, books, workers, into_folder))
+            if not sync.is_complete():
+                logger.warning('Finishing shards left over by failed workers.')
+        if not sync.is_complete():
+            results.extend(sync.run(api_client, formats, books, into_folder))
+        return results, sync.failed_files()
+    finally:
+        if run_id is None:
+            sync.remove()
@@ -1,31 +1,68 @@
+import abc
 import requests
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from urllib.parse import urljoin
 
 from .logger import get_logger
+from .timing import count, span
 logger = get_logger(__name__)
 
 API_URL = 'https://api.anti-captcha.com'
-CREATE_TASK_API_URL = urljoin(API_URL, 'createTask')
-GET_TASK_API_URL = urljoin(API_URL, 'getTaskResult')
+
+RECAPTCHA_PROXYLESS_QUEUE_ID = 6
+RECAPTCHA_SOLUTION_LIFETIME = 110  # Google accepts a solution for 120 seconds, keep a safety margin.
 
 
 class AnticaptchaException(Exception):
     pass
 
 
-class Anticaptcha(object):
+class CaptchaSolver(abc.ABC):
+    """Interface of captcha solving services used to solve Packt's reCaptcha."""
+    default_solve_time = 30.0  # Typical ReCAPTCHA solve time in seconds, used until the service reports its own.
+    options = {}  # Options configurable in ANTICAPTCHA_DATA section mapped to functions converting their values.
+
+    @property
+    def expected_solve_time(self):
+        """Return typical time in seconds needed to solve a ReCAPTCHA."""
+        return self.default_solve_time
+
+    @abc.abstractmethod
+    def solve_recaptcha(self, website_url, website_key):
+        """Return ReCAPTCHA solution for given website."""
+
+
+class Anticaptcha(CaptchaSolver):
     """
     anti-captcha.com client which helps to solve reCaptchas
     More info concerning the API: https://anti-captcha.com/apidoc/
     """
     timeout = 120  # Timeout in second - during busy periods, we may need to wait about 2 minutes to solve ReCAPTCHA.
+    min_poll_interval = 1.0
+    max_poll_interval = 5.0
+    options = {
+        'api_url': str,
+        'timeout': float,
+        'min_poll_interval': float,
+        'max_poll_interval': float
+    }
 
-    def __init__(self, api_key):
+    def __init__(self, api_key, api_url=API_URL, timeout=None, min_poll_interval=None, max_poll_interval=None):
         self.api_key = api_key
+        self.timeout = timeout or self.timeout
+        self.min_poll_interval = min_poll_interval or self.min_poll_interval
+        self.max_poll_interval = max_poll_interval or self.max_poll_interval
+        self.create_task_url = urljoin(api_url, 'createTask')
+        self.get_task_url = urljoin(api_url, 'getTaskResult')
+        self.get_queue_stats_url = urljoin(api_url, 'getQueueStats')
+        self.session = requests.Session()
+        self._expected_solve_time = None
 
     def __post_request(self, url, **kwargs):
-        response = requests.post(url, **kwargs).json()
+        count('captcha_requests')
+        response = self.session.post(url, **kwargs).json()
         if response.get('errorId'):
             raise AnticaptchaException("Error {0} occured: {1}".format(
                 response.get('errorCode'),
@@ -42,22 +79,44 @@ class Anticaptcha(object):
                 "websiteKey": website_key
             }
         }
-        response = self.__post_request(CREATE_TASK_API_URL, json=content)
+        response = self.__post_request(self.create_task_url, json=content)
         return response.get('taskId')
 
+    @property
+    def expected_solve_time(self):
+        """Return typical solve time in seconds, asking the service for its current queue speed on first use."""
+        if self._expected_solve_time is None:
+            try:
+                content = {'queueId': RECAPTCHA_PROXYLESS_QUEUE_ID}
+                response = self.__post_request(self.get_queue_stats_url, json=content)
+                self._expected_solve_time = float(response['speed']) or self.default_solve_time
+            except Exception:
+                self._expected_solve_time = self.default_solve_time
+        return self._expected_solve_time
+
+    def __record_solve_time(self, solve_time):
+        """Update expected solve time with an exponentially weighted moving average of observed solve times."""
+        self._expected_solve_time = 0.7 * self.expected_solve_time + 0.3 * solve_time
+
     def __wait_for_task_result(self, task_id):
         start_time = time.time()
         content = {
             'clientKey': self.api_key,
             'taskId': task_id
         }
+        # A task is hardly ever solved in less than half of the typical solve time, so don't poll before that.
+        expected_solve_time = self.expected_solve_time
+        poll_interval = min(max(expected_solve_time / 10, self.min_poll_interval), self.max_poll_interval)
+        time.sleep(min(expected_solve_time / 2, self.timeout))
         while (time.time() - start_time) < self.timeout:
-            response = self.__post_request(GET_TASK_API_URL, json=content)
+            response = self.__post_request(self.get_task_url, json=content)
             if response.get('status') == 'ready':
+                self.__record_solve_time(time.time() - start_time)
                 return response
-            time.sleep(1)
+            time.sleep(poll_interval)
         raise AnticaptchaException('Timeout {} reached '.format(self.timeout))
 
+    @span('captcha')
     def solve_recaptcha(self, website_url, website_key):
         logger.info('Started solving ReCAPTCHA for {} website...'.format(website_url))
         task_id = self.__create_noproxy_task(website_url, website_key)
@@ -67,6 +126,126 @@ class Anticaptcha(object):
         return solution
 
 
+class RecaptchaSolution(object):
+    """ReCAPTCHA solution together with the moment it stops being accepted."""
+
+    def __init__(self, value, lifetime=RECAPTCHA_SOLUTION_LIFETIME):
+        self.value = value
+        self.expires_at = time.time() + lifetime
+
+    @property
+    def expired(self):
+        return time.time() >= self.expires_at
+
+
+class RecaptchaPool(object):
+    """
+    Solves ReCAPTCHAs in background threads and keeps a small pool of fresh solutions.
+
+    Solving starts only when `prefetch` or `get` is called, so solutions which are never used aren't paid for.
+    Solutions older than their lifetime are dropped instead of being handed out.
+    """
+
+    def __init__(self, solver, website_url, website_key, size=1, lifetime=RECAPTCHA_SOLUTION_LIFETIME):
+        self.solver = solver
+        self.website_url = website_url
+        self.website_key = website_key
+        self.size = size
+        self.lifetime = lifetime
+        self._lock = threading.Lock()
+        self._solutions = []
+        self._pending = []
+        self._executor = ThreadPoolExecutor(max_workers=size)
+
+    def __solve(self):
+        return RecaptchaSolution(self.solver.solve_recaptcha(self.website_url, self.website_key), self.lifetime)
+
+    def __drop_stale(self):
+        for future in [future for future in self._pending if future.done()]:
+            self._pending.remove(future)
+            try:
+                self._solutions.append(future.result())
+            except Exception as e:
+                logger.error('Solving ReCAPTCHA in background failed: {}'.format(e))
+        self._solutions = [solution for solution in self._solutions if not solution.expired]
+
+    def prefetch(self, count=None):
+        """Start background solves until `count` solutions (pool size by default) are ready or pending."""
+        with self._lock:
+            self.__drop_stale()
+            missing = (count or self.size) - len(self._solutions) - len(self._pending)
+            for _ in range(max(missing, 0)):
+                self._pending.append(self._executor.submit(self.__solve))
+
+    def get(self, timeout=None):
+        """Return a fresh ReCAPTCHA solution, waiting for a background solve to finish if none is ready."""
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            with self._lock:
+                self.__drop_stale()
+                if self._solutions:
+                    return self._solutions.pop(0).value
+                if not self._pending:
+                    self._pending.append(self._executor.submit(self.__solve))
+                future = self._pending[0]
+            wait_time = None if deadline is None else max(deadline - time.time(), 0)
+            try:
+                future.result(timeout=wait_time)
+            except FutureTimeoutError:
+                raise AnticaptchaException('Timeout {} reached while waiting for ReCAPTCHA solution'.format(timeout))
+            except Exception:
+                with self._lock:
+                    if future in self._pending:
+                        self._pending.remove(future)
+                raise
+
+    def shutdown(self, wait=False):
+        """Stop the background solver threads."""
+        with self._lock:
+            for future in self._pending:
+                future.cancel()
+            self._pending = []
+        self._executor.shutdown(wait=wait)
+
+
+SOLVER_BACKENDS = {
+    'anticaptcha': Anticaptcha,
+}
+
+
+def get_solver(backend, api_key, **options):
+    """
+    Return captcha solver of given backend.
+
+    `options` (e.g. read as strings from the config file) are converted to types expected by the backend
+    and passed to its constructor, unsupported options raise ValueError.
+    """
+    try:
+        solver_class = SOLVER_BACKENDS[backend]
+    except KeyError:
+        raise ValueError("Unknown captcha solver backend '{}'. Available backends are: {}".format(
+            backend,
+            ', '.join(sorted(SOLVER_BACKENDS))
+        ))
+    converted_options = {}
+    for name, value in options.items():
+        if name not in solver_class.options:
+            raise ValueError("Unknown option '{}' of '{}' captcha solver backend. Available options are: {}".format(
+                name,
+                backend,
+                ', '.join(sorted(solver_class.options))
+            ))
+        try:
+            converted_options[name] = solver_class.options[name](value)
+        except ValueError:
+            raise ValueError("Invalid value '{}' of '{}' option of '{}' captcha solver backend.".format(
+                value,
+                name,
+                backend
+            ))
+    return solver_class(api_key, **converted_options)
+
+
 def solve_recaptcha(anticaptcha_key, website_url, website_key):
     """Solve ReCAPTCHA task for given website."""
     anticaptcha = Anticaptcha(anticaptcha_key)
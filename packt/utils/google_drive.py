@@ -5,13 +5,8 @@ import logging
 import os
 import sys
 
-from apiclient import discovery
-from apiclient.http import MediaFileUpload, MediaIoBaseDownload
-import httplib2
-from oauth2client import client, tools
-from oauth2client.file import Storage
-
 from .logger import get_logger
+from .timing import count, span
 
 logger = get_logger(__name__)
 
@@ -24,6 +19,10 @@ class GoogleDriveManager(object):
     """Allows to upload and download new content to Google Drive"""
 
     def __init__(self, cfg_file_path):
+        # Google API client libraries take long to import, so they are imported only when Drive is actually used.
+        from apiclient import discovery
+        import httplib2
+
         self._set_config_data(cfg_file_path)
         self._root_folder = GoogleDriveFile(self.folder_name)
         self._credentials = self._get_credentials()
@@ -56,6 +55,9 @@ class GoogleDriveManager(object):
 
         Returns: the obtained credentials.
         """
+        from oauth2client import client, tools
+        from oauth2client.file import Storage
+
         home_dir = os.path.dirname(self.cfg_file_path)
         credential_dir = os.path.join(home_dir, '.credentials')
         if not os.path.exists(credential_dir):
@@ -143,6 +145,8 @@ class GoogleDriveManager(object):
         return file_name, file_extension, mime_type
 
     def __insert_file_into_folder(self, file_name, path, parent_folder_id, file_mime_type=None):
+        from apiclient.http import MediaFileUpload
+
         parent_id = parent_folder_id if parent_folder_id is None else [parent_folder_id]
         file_metadata = {
           'name': file_name,
@@ -165,7 +169,9 @@ class GoogleDriveManager(object):
                 try:
                     file_attrs = self.__extract_filename_ext_and_mimetype_from_path(path)
                     if not self.__find_folder_or_file_by_name(file_attrs[0], self._root_folder.id):
-                        self.__insert_file_into_folder(file_attrs[0], path, self._root_folder.id, file_attrs[2])
+                        with span('upload', file=file_attrs[0]):
+                            self.__insert_file_into_folder(file_attrs[0], path, self._root_folder.id, file_attrs[2])
+                        count('bytes_uploaded', os.path.getsize(path))
                         logger.success('File {} succesfully sent to Google Drive'.format(file_attrs[0]))
                     else:
                         logger.info('File {} already exists on Google Drive'.format(file_attrs[0]))
@@ -173,6 +179,8 @@ class GoogleDriveManager(object):
                     logger.error('Error {} occurred while sending file: {} to Google Drive'.format(e, file_attrs[0]))
 
     def download_file(self, file_name, file_id):
+        from apiclient.http import MediaIoBaseDownload
+
         request = self._service.files().get_media(fileId=file_id)
         fh = io.FileIO(file_name, 'wb')
         downloader = MediaIoBaseDownload(fh, request)
@@ -0,0 +1,155 @@
+"""Leases on files in a shared (e.g. NFS) directory, used to coordinate work of several processes and hosts."""
+import os
+import socket
+import threading
+import time
+import uuid
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+LEASE_TTL = 60  # seconds without a heartbeat after which a lease is considered abandoned
+
+
+def new_owner_id():
+    """Return id unique to the calling process, identifying the owner of its leases."""
+    return '{}-{}-{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+
+
+class Lease(object):
+    """
+    Exclusive claim of a lock file at `path`, created atomically and holding id of its owner.
+
+    The owner keeps the lease alive by refreshing the file's modification time. A lease whose modification time
+    has not changed for `ttl` seconds, measured by the clock of the process trying to acquire it (so that clock skew
+    between hosts doesn't matter), is abandoned and may be broken and taken over.
+    """
+
+    def __init__(self, path, owner, ttl=LEASE_TTL):
+        self.path = path
+        self.owner = owner
+        self.ttl = ttl
+        self.held = False
+        self._observed = None  # (modification time, local time it was first seen) of the lease of another owner
+
+    def acquire(self):
+        """Try to acquire the lease without waiting, breaking it first if it's abandoned; return whether it's held."""
+        if self.held:
+            return True
+        if not self._create() and self._is_abandoned():
+            self._break()
+            self._create()
+        return self.held
+
+    def wait(self, interval=1.0, cancelled=None):
+        """Block until the lease is acquired or `cancelled()` returns true, return whether it's held."""
+        while not self.acquire():
+            if cancelled is not None and cancelled():
+                return False
+            time.sleep(interval)
+        return True
+
+    def refresh(self):
+        """Keep the lease alive, return False if it has been taken over by someone else in the meantime."""
+        if not self.held:
+            return False
+        try:
+            if self._read_owner() == self.owner:
+                os.utime(self.path)
+                return True
+        except OSError:
+            pass
+        self.held = False
+        logger.warning('Lease {} has been lost.'.format(self.path))
+        return False
+
+    def release(self):
+        if not self.held:
+            return
+        self.held = False
+        try:
+            if self._read_owner() == self.owner:
+                os.remove(self.path)
+        except OSError as e:
+            logger.warning('Releasing lease {} failed: {}'.format(self.path, e))
+
+    def _create(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            f.write(self.owner)
+        self.held = True
+        self._observed = None
+        return True
+
+    def _read_owner(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def _is_abandoned(self):
+        try:
+            modified_at = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return False
+        if self._observed is None or self._observed[0] != modified_at:
+            self._observed = (modified_at, time.monotonic())
+            return False
+        return time.monotonic() - self._observed[1] > self.ttl
+
+    def _break(self):
+        # Renaming is atomic also on NFS, so only one of the processes breaking an abandoned lease succeeds.
+        broken_path = '{}.{}.broken'.format(self.path, self.owner)
+        try:
+            os.rename(self.path, broken_path)
+        except FileNotFoundError:
+            return
+        try:
+            if os.stat(broken_path).st_mtime != self._observed[0]:
+                # The lease was broken and taken over by someone else since we checked it, give it back.
+                try:
+                    os.link(broken_path, self.path)
+                except FileExistsError:
+                    pass
+                return
+            with open(broken_path) as f:
+                logger.warning('Breaking lease {} abandoned by {}.'.format(self.path, f.read()))
+        finally:
+            os.remove(broken_path)
+
+
+class Heartbeat(object):
+    """Background thread refreshing held leases every `interval` seconds."""
+
+    def __init__(self, interval=LEASE_TTL / 4):
+        self.interval = interval
+        self._leases = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self._stop_event.set()
+        self._thread.join()
+
+    def add(self, lease):
+        with self._lock:
+            self._leases.add(lease)
+
+    def discard(self, lease):
+        with self._lock:
+            self._leases.discard(lease)
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            with self._lock:
+                leases = list(self._leases)
+            for lease in leases:
+                if not lease.refresh():
+                    self.discard(lease)
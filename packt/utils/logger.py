@@ -1,48 +1,168 @@
-#!/usr/bin/env python
-
-import logging
-import os
-import sys
-
-
-def get_logger(module_name, log_folder_path=os.getcwd()):
-    """
-        module_name just to distinguish where the logs come from
-    """
-
-    LOG_FILE_PATH = os.path.join(log_folder_path, "LOG_FILE.log")
-
-    # adding a new logging level
-    logging.SUCCESS = 19   # as ALL = 0, DEBUG = 10, INFO = 20, WARN = 30, ERROR = 40, FATAL = CRITICAL, CRITICAL = 50
-    logging.addLevelName(logging.SUCCESS, 'SUCCESS')
-    logger = logging.getLogger(module_name)
-    logger.success = lambda msg, *args: logger._log(logging.SUCCESS, msg, args)
-
-    # create formatters
-    console_log_formatter = logging.Formatter('[%(levelname)s] - %(message)s')
-    file_log_formatter = logging.Formatter('%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
-
-    # create file handler
-    file_handler = logging.FileHandler(LOG_FILE_PATH)
-    file_handler.setFormatter(file_log_formatter)
-    file_handler.setLevel(logging.DEBUG)
-
-    # create console log handler
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setFormatter(console_log_formatter)
-    stream_handler.setLevel(logging.SUCCESS)
-
-    logger.setLevel(logging.SUCCESS)
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
-    return logger
-
-
-if __name__ == "__main__":
-    logger = get_logger('_this is me')
-    logger.debug('This is debug level')
-    logger.info('This is info level')
-    logger.warning('This is warning level')
-    logger.error('This is error level')
-    logger.critical('This is critical level')
-    logger.success('This is success level')
+#!/usr/bin/env python
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+LOGGER_NAME = 'packt'  # all script's loggers are children of this one, so handlers are configured only here
+LOG_FILE_NAME = 'LOG_FILE.log'
+JSON_LOG_FILE_NAME = 'LOG_FILE.jsonl'
+LOG_FILE_MAX_BYTES = 5 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 3
+
+# adding a new logging level
+logging.SUCCESS = 19   # as ALL = 0, DEBUG = 10, INFO = 20, WARN = 30, ERROR = 40, FATAL = CRITICAL, CRITICAL = 50
+logging.addLevelName(logging.SUCCESS, 'SUCCESS')
+
+_queue_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats log records as single line JSON objects."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'timestamp': record.created,
+            'name': record.name,
+            'level': record.levelname,
+            'thread': record.threadName,
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler leaving formatting of records to the listener's handlers.
+
+    Unlike the default one it doesn't merge traceback into the message, it's only rendered into `exc_text` as
+    traceback objects can't be sent to other processes, so that e.g. JSON log file gets it as a separate field.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(log_folder_path=None, json_lines=False, max_bytes=LOG_FILE_MAX_BYTES,
+                  backup_count=LOG_FILE_BACKUP_COUNT, level=logging.SUCCESS):
+    """
+        Configure file and console handlers of script's loggers, subsequent calls have no effect.
+
+        Loggers only put records into a queue, which is written to a size-rotated log file and to the console
+        by a listener thread, so logging never blocks on disk or terminal I/O.
+        With `json_lines` the log file contains JSON objects (one per line) instead of plain text.
+    """
+    global _queue_listener
+    if _queue_listener is not None:
+        return
+
+    log_folder_path = log_folder_path or os.getcwd()
+    log_file_path = os.path.join(log_folder_path, JSON_LOG_FILE_NAME if json_lines else LOG_FILE_NAME)
+
+    # create formatters
+    console_log_formatter = logging.Formatter('[%(levelname)s] - %(message)s')
+    file_log_formatter = JsonFormatter() if json_lines else\
+        logging.Formatter('%(asctime)s - %(name)s - [%(levelname)s] - %(message)s')
+
+    # create file handler
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file_path,
+        maxBytes=max_bytes,
+        backupCount=backup_count,
+        delay=True
+    )
+    file_handler.setFormatter(file_log_formatter)
+    file_handler.setLevel(logging.DEBUG)
+
+    # create console log handler
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(console_log_formatter)
+    stream_handler.setLevel(logging.SUCCESS)
+
+    log_queue = queue.Queue(-1)
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.addHandler(_QueueHandler(log_queue))
+    logger.propagate = False
+
+    _queue_listener = logging.handlers.QueueListener(
+        log_queue,
+        file_handler,
+        stream_handler,
+        respect_handler_level=True
+    )
+    _queue_listener.start()
+    atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """Write out all queued log records and stop the listener thread."""
+    global _queue_listener
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        for handler in _queue_listener.handlers:
+            handler.close()
+        _queue_listener = None
+
+
+class _ForwardingHandler(logging.Handler):
+    """Passes records of worker processes to the same-named loggers of this process."""
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def setup_worker_logging(log_queue, level=logging.SUCCESS):
+    """Configure script's loggers of a worker process to put records into `log_queue` shared with its parent."""
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    logger.addHandler(_QueueHandler(log_queue))
+    logger.propagate = False
+
+
+def forward_worker_logs(log_queue):
+    """Start and return a listener writing records put into `log_queue` by worker processes to script's handlers."""
+    listener = logging.handlers.QueueListener(log_queue, _ForwardingHandler())
+    listener.start()
+    return listener
+
+
+def get_logger(module_name):
+    """
+        module_name just to distinguish where the logs come from
+    """
+    logger = logging.getLogger(module_name)
+
+    def success(msg, *args, **kwargs):
+        if logger.isEnabledFor(logging.SUCCESS):
+            logger._log(logging.SUCCESS, msg, args, **kwargs)
+
+    logger.success = success
+    return logger
+
+
+if __name__ == "__main__":
+    setup_logging(level=logging.DEBUG)
+    logger = get_logger('{}._this is me'.format(LOGGER_NAME))
+    logger.debug('This is debug level')
+    logger.info('This is info level')
+    logger.warning('This is warning level')
+    logger.error('This is error level')
+    logger.critical('This is critical level')
+    logger.success('This is success level')
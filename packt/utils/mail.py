@@ -8,6 +8,7 @@ from email.mime.text import MIMEText
 from email.utils import COMMASPACE, formatdate
 
 from .logger import get_logger
+from .timing import count, span
 
 logger = get_logger(__name__)
 
@@ -47,6 +48,7 @@ class MailBook:
         msg.attach(MIMEText(body))
         return msg
 
+    @span('mail')
     def _send_email(self, msg):
         try:
             smtp = smtplib.SMTP(host=self._smtp_host, port=int(self._smtp_port))
@@ -55,7 +57,9 @@ class MailBook:
             smtp.ehlo()
             smtp.login(self._send_from, self._email_pass)
             logger.info('Sending email from {} to {} ...'.format(self._send_from, ','.join(self._to_emails)))
-            smtp.sendmail(self._send_from, self._to_emails, msg.as_string())
+            message = msg.as_string()
+            smtp.sendmail(self._send_from, self._to_emails, message)
+            count('bytes_mailed', len(message))
             logger.info('Email to {} has been succesfully sent'.format(','.join(self._to_emails)))
         except Exception as e:
             logger.error('Sending failed with an error: {}'.format(str(e)))
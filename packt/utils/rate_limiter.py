@@ -0,0 +1,132 @@
+"""Adaptive limits of concurrent requests made to each host."""
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_INITIAL_LIMIT = 4
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 10
+
+
+class AdaptiveConcurrencyLimiter(object):
+    """
+    Limits number of concurrent requests to a single host using additive increase/multiplicative decrease.
+
+    The limit grows by one per limit-many successful requests and is cut by `backoff_factor` whenever the host
+    is overloaded (429 or 5xx responses, connection errors) or its latency rises above `latency_tolerance` times
+    the lowest average latency seen recently. The limit is cut at most once per average latency, so a burst of
+    errors caused by a single overload counts once.
+    """
+
+    def __init__(self, host, initial_limit=DEFAULT_INITIAL_LIMIT, min_limit=DEFAULT_MIN_LIMIT,
+                 max_limit=DEFAULT_MAX_LIMIT, backoff_factor=0.5, latency_tolerance=3.0):
+        self.host = host
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff_factor = backoff_factor
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.latency = None
+        self.baseline_latency = None
+        self.paused_until = 0.0
+        self.requests = 0
+        self.overloads = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Wait until a request to the host can be made."""
+        with self._condition:
+            while True:
+                pause = self.paused_until - time.time()
+                if pause <= 0 and self.in_flight < int(self.limit):
+                    break
+                self._condition.wait(pause if pause > 0 else None)
+            self.in_flight += 1
+
+    def release(self, latency=None, overloaded=False):
+        """Record outcome of a finished request and adapt the limit."""
+        with self._condition:
+            self.in_flight -= 1
+            self.requests += 1
+            if latency is not None:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+                # Baseline slowly drifts up, so that a lasting change of network conditions doesn't pin the limit.
+                self.baseline_latency = min((self.baseline_latency or self.latency) * 1.01, self.latency)
+            if overloaded:
+                self.overloads += 1
+                self._decrease('host overloaded')
+            elif self.latency is not None and self.latency > self.latency_tolerance * self.baseline_latency:
+                self._decrease('latency rose to {:.3f} s'.format(self.latency))
+            else:
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+            self._condition.notify_all()
+
+    def pause(self, seconds):
+        """Hold back all requests to the host for given time, e.g. as asked by Retry-After header."""
+        with self._condition:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self._condition.notify_all()
+
+    def _decrease(self, reason):
+        now = time.time()
+        if now - self._last_decrease < (self.latency or 0):
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.limit = max(self.limit * self.backoff_factor, self.min_limit)
+        logger.info('Concurrency limit of {} decreased to {:.1f} ({}).'.format(self.host, self.limit, reason))
+
+    def state(self):
+        """Return current limit, latencies and statistics of the limiter."""
+        with self._condition:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'latency': self.latency,
+                'baseline_latency': self.baseline_latency,
+                'paused_for': max(self.paused_until - time.time(), 0),
+                'requests': self.requests,
+                'overloads': self.overloads,
+                'decreases': self.decreases
+            }
+
+
+class RateLimiter(object):
+    """Adaptive concurrency limiters of all hosts requested through a client, created on first request to a host."""
+
+    def __init__(self, **limiter_options):
+        self.limiter_options = limiter_options
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def for_url(self, url):
+        """Return limiter of the host of given URL."""
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._limiters:
+                self._limiters[host] = AdaptiveConcurrencyLimiter(host, **self.limiter_options)
+            return self._limiters[host]
+
+    def state(self):
+        """Return state of all hosts' limiters for monitoring."""
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {host: limiter.state() for host, limiter in limiters.items()}
+
+    def split_options(self, parts):
+        """
+        Return limiter options splitting limits of this rate limiter among `parts` clients, e.g. worker processes,
+        so that together they don't make more concurrent requests to a host than a single client would.
+        """
+        options = dict(self.limiter_options)
+        for name, default in (('initial_limit', DEFAULT_INITIAL_LIMIT), ('max_limit', DEFAULT_MAX_LIMIT)):
+            options[name] = max(1, int(options.get(name, default) // parts))
+        options['min_limit'] = min(options.get('min_limit', DEFAULT_MIN_LIMIT), options['initial_limit'])
+        return options
@@ -0,0 +1,173 @@
+"""Nested timing spans and counters of a script run, written as JSON report and optionally as trace-event file."""
+import itertools
+import json
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+
+class Span(object):
+    """Timed phase of a run, spans started inside another span of the same thread are its children."""
+
+    def __init__(self, span_id, name, parent_id, attrs):
+        self.id = span_id
+        self.name = name
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.thread_id = threading.get_ident()
+        self.thread_name = threading.current_thread().name
+        self.start = time.perf_counter()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+
+class RunReport(object):
+    """Collects spans and counters (e.g. bytes moved, requests made) of a single run."""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self._spans = []
+        self._span_ids = itertools.count()
+        self._counters = Counter()
+        self._sections = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed block as a span called `name`, `attrs` are stored with it and may be updated inside."""
+        stack = self._stack()
+        with self._lock:
+            span = Span(next(self._span_ids), name, stack[-1].id if stack else None, attrs)
+            self._spans.append(span)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.attrs['error'] = repr(e)
+            raise
+        finally:
+            span.end = time.perf_counter()
+            stack.pop()
+
+    def count(self, name, value=1):
+        """Add `value` to counter `name`."""
+        with self._lock:
+            self._counters[name] += value
+
+    def add_section(self, name, provider):
+        """Add report section `name` with content returned by `provider()` at the time the report is written."""
+        with self._lock:
+            self._sections[name] = provider
+
+    def reset(self):
+        """Drop spans and counters recorded so far, e.g. once they have been written after a job of a daemon."""
+        with self._lock:
+            self.started_at = time.time()
+            self._origin = time.perf_counter()
+            self._spans = []
+            self._counters = Counter()
+
+    def _span_dict(self, span, children):
+        return OrderedDict([
+            ('name', span.name),
+            ('start', span.start - self._origin),
+            ('duration', span.duration),
+            ('thread', span.thread_name),
+            ('attrs', span.attrs),
+            ('children', [self._span_dict(child, children) for child in children.get(span.id, [])])
+        ])
+
+    def to_dict(self):
+        """Return report with span tree, total time spent in each phase and counters."""
+        with self._lock:
+            spans = list(self._spans)
+            counters = dict(self._counters)
+            sections = list(self._sections.items())
+        children = {}
+        span_ids = {span.id for span in spans}
+        for span in spans:
+            # Spans started before the last reset are dropped, their children become top-level spans.
+            children.setdefault(span.parent_id if span.parent_id in span_ids else None, []).append(span)
+        phases = OrderedDict()
+        for span in spans:
+            phase = phases.setdefault(span.name, {'count': 0, 'seconds': 0.0})
+            phase['count'] += 1
+            phase['seconds'] += span.duration
+        return OrderedDict([
+            ('started_at', self.started_at),
+            ('duration', time.perf_counter() - self._origin),
+            ('counters', counters),
+            ('phases', phases),
+            ('spans', [self._span_dict(span, children) for span in children.get(None, [])])
+        ] + [(name, provider()) for name, provider in sections])
+
+    def to_trace_events(self):
+        """Return report in Trace Event Format, viewable e.g. in chrome://tracing or Perfetto UI."""
+        with self._lock:
+            spans = list(self._spans)
+            counters = dict(self._counters)
+        pid = os.getpid()
+        events = [
+            {
+                'name': span.name,
+                'cat': 'packt',
+                'ph': 'X',
+                'ts': (span.start - self._origin) * 1e6,
+                'dur': span.duration * 1e6,
+                'pid': pid,
+                'tid': span.thread_id,
+                'args': span.attrs
+            }
+            for span in spans
+        ]
+        events.extend(
+            {'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in {(span.thread_id, span.thread_name) for span in spans}
+        )
+        events.append({
+            'name': 'counters',
+            'ph': 'C',
+            'ts': (time.perf_counter() - self._origin) * 1e6,
+            'pid': pid,
+            'args': counters
+        })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def write(self, report_path=None, trace_path=None):
+        """Write JSON report and trace-event file into given paths, if they are set."""
+        if report_path:
+            with open(report_path, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2, default=str)
+        if trace_path:
+            with open(trace_path, 'w') as f:
+                json.dump(self.to_trace_events(), f, default=str)
+
+
+_run_report = RunReport()
+
+
+def get_run_report():
+    """Return report of the current run."""
+    return _run_report
+
+
+def span(name, **attrs):
+    """Time the enclosed block as a span of the current run's report."""
+    return _run_report.span(name, **attrs)
+
+
+def count(name, value=1):
+    """Add `value` to counter `name` of the current run's report."""
+    _run_report.count(name, value)
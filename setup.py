@@ -27,7 +27,7 @@ dev_requirements = [
 setup(
     name='packt',
     version=package_version,
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
     license='MIT',
     description='Script for grabbing daily Packt Free Learning ebooks',
     author='Łukasz Uszko',
@@ -0,0 +1,141 @@
+import threading
+import time
+import unittest
+
+import requests
+
+from packt.api import PACKT_API_LOGIN_URL, PacktAPIClient
+from packt.utils.rate_limiter import AdaptiveConcurrencyLimiter, RateLimiter
+
+
+class AdaptiveConcurrencyLimiterTest(unittest.TestCase):
+
+    def test_limit_grows_by_one_per_limit_successful_requests(self):
+        limiter = AdaptiveConcurrencyLimiter('host', initial_limit=2)
+        for _ in range(2):
+            limiter.acquire()
+            limiter.release(0.1)
+        self.assertAlmostEqual(limiter.limit, 2 + 1 / 2 + 1 / 2.5)
+
+    def test_limit_does_not_grow_above_max_limit(self):
+        limiter = AdaptiveConcurrencyLimiter('host', initial_limit=2, max_limit=3)
+        for _ in range(20):
+            limiter.acquire()
+            limiter.release(0.1)
+        self.assertEqual(limiter.limit, 3)
+
+    def test_overload_cuts_limit_once_per_latency(self):
+        limiter = AdaptiveConcurrencyLimiter('host', initial_limit=8, backoff_factor=0.5)
+        limiter.acquire()
+        limiter.release(10.0)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(overloaded=True)
+        self.assertAlmostEqual(limiter.limit, (8 + 1 / 8) * 0.5)
+        self.assertEqual(limiter.overloads, 3)
+        self.assertEqual(limiter.decreases, 1)
+
+    def test_overload_does_not_cut_limit_below_min_limit(self):
+        limiter = AdaptiveConcurrencyLimiter('host', initial_limit=2, min_limit=1)
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(overloaded=True)
+            limiter._last_decrease = 0.0
+        self.assertEqual(limiter.limit, 1)
+
+    def test_latency_rise_cuts_limit(self):
+        limiter = AdaptiveConcurrencyLimiter('host', initial_limit=4, latency_tolerance=2.0)
+        limiter.acquire()
+        limiter.release(0.001)
+        limiter.acquire()
+        limiter.release(1.0)
+        self.assertEqual(limiter.decreases, 1)
+        self.assertAlmostEqual(limiter.limit, (4 + 1 / 4) * 0.5)
+
+    def test_acquire_waits_for_release_when_limit_is_reached(self):
+        limiter = AdaptiveConcurrencyLimiter('host', initial_limit=1)
+        limiter.acquire()
+        acquired = threading.Event()
+
+        def acquire():
+            limiter.acquire()
+            acquired.set()
+        thread = threading.Thread(target=acquire)
+        thread.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release(0.01)
+        self.assertTrue(acquired.wait(1))
+        thread.join()
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_pause_holds_back_requests(self):
+        limiter = AdaptiveConcurrencyLimiter('host')
+        limiter.pause(0.2)
+        start = time.time()
+        limiter.acquire()
+        self.assertGreaterEqual(time.time() - start, 0.15)
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_limiter_is_shared_by_urls_of_the_same_host(self):
+        rate_limiter = RateLimiter(initial_limit=3)
+        limiter = rate_limiter.for_url('https://services.packtpub.com/a')
+        self.assertIs(limiter, rate_limiter.for_url('https://services.packtpub.com/b?c=d'))
+        self.assertIsNot(limiter, rate_limiter.for_url('https://static.packt-cdn.com/a'))
+        self.assertEqual(limiter.limit, 3)
+        self.assertEqual(sorted(rate_limiter.state()), ['services.packtpub.com', 'static.packt-cdn.com'])
+
+    def test_split_options_divide_limits_among_clients(self):
+        options = RateLimiter(max_limit=9, backoff_factor=0.25).split_options(3)
+        self.assertEqual(options, {'initial_limit': 1, 'min_limit': 1, 'max_limit': 3, 'backoff_factor': 0.25})
+        options = RateLimiter(initial_limit=2, min_limit=2).split_options(8)
+        self.assertEqual(options['initial_limit'], 1)
+        self.assertEqual(options['min_limit'], 1)
+        self.assertEqual(options['max_limit'], 1)
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = ''
+        self._data = data
+
+    def json(self):
+        return self._data
+
+
+class FakeSession(object):
+    """Session logging in successfully and failing all other requests with given exception."""
+
+    def __init__(self, error):
+        self.headers = {}
+        self.error = error
+
+    def request(self, method, url, **kwargs):
+        if url == PACKT_API_LOGIN_URL:
+            return FakeResponse(200, {'data': {'access': 'token'}})
+        raise self.error
+
+
+class PacktAPIClientLimitTest(unittest.TestCase):
+
+    def assert_slots_released(self, error, expected_error):
+        client = PacktAPIClient({'username': 'user', 'password': 'password'}, session=FakeSession(error),
+                                rate_limiter=RateLimiter(initial_limit=2))
+        for _ in range(5):
+            with self.assertRaises(expected_error):
+                client.send('get', 'https://services.packtpub.com/products')
+        self.assertEqual(client.rate_limiter.for_url('https://services.packtpub.com/').in_flight, 0)
+
+    def test_slot_is_released_after_request_error(self):
+        self.assert_slots_released(requests.exceptions.InvalidURL('invalid'), requests.exceptions.InvalidURL)
+
+    def test_slot_is_released_after_unexpected_error(self):
+        self.assert_slots_released(ValueError('unexpected'), ValueError)
+
+
+if __name__ == '__main__':
+    unittest.main()